@@ -0,0 +1,161 @@
+# Benchmark Whisper models in fp32 versus dynamic int8 quantization (see
+# transcribe_fragments.load_model) on CPU.
+#
+# A sample of short fragments per language is transcribed with each model, and the
+# script prints the throughput (seconds of audio transcribed per second) and the word
+# error rate (WER) against the fp32 transcripts already in
+# `fragments-short-matlab-transcribed.csv`, created by transcribe_fragments.py.
+
+import argparse
+import time
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import whisper
+from transcribe_fragments import load_model, slice_audio, whisper_lang_to_model_name
+from whisper.normalizers import BasicTextNormalizer
+
+RANDOM_STATE_VAL = 42
+
+
+def main():
+    dir_this_file = Path(__file__).parent.resolve()
+
+    parser = argparse.ArgumentParser(
+        description="Compare the throughput and word error rate of Whisper models in "
+        "fp32 and with dynamic int8 quantization, on CPU.",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+    )
+    parser.add_argument(
+        "-i",
+        "--path_metadata",
+        help="Path to transcribed short fragment metadata, output of "
+        "transcribe_fragments.py. Its 'text' column is the reference transcript.",
+        default=dir_this_file.joinpath(
+            "release/fragments-short-matlab-transcribed.csv"
+        ),
+    )
+    parser.add_argument(
+        "-n",
+        "--n_frags",
+        help="Number of fragments to sample per language.",
+        type=int,
+        default=200,
+    )
+    parser.add_argument(
+        "--model_en",
+        help="Whisper model for English, e.g. a larger model than the default.",
+        default=whisper_lang_to_model_name["en"],
+    )
+    parser.add_argument(
+        "--model_es",
+        help="Whisper model for Spanish, e.g. a larger model than the default.",
+        default=whisper_lang_to_model_name["es"],
+    )
+    args = parser.parse_args()
+
+    path_metadata = Path(args.path_metadata)
+    dir_release = path_metadata.parent
+
+    df_frags = pd.read_csv(path_metadata, index_col="id")
+    df_frags["time_start_rel"] = pd.to_timedelta(df_frags["time_start_rel"])
+    df_frags["time_end_rel"] = pd.to_timedelta(df_frags["time_end_rel"])
+    df_frags = df_frags.dropna(subset=["text"])
+
+    for whisper_lang_code, model_name in [
+        ("en", args.model_en),
+        ("es", args.model_es),
+    ]:
+        df_frags_lang = df_frags[df_frags["lang_code"] == whisper_lang_code.upper()]
+        n_frags = min(args.n_frags, df_frags_lang.shape[0])
+        df_frags_lang = df_frags_lang.sample(n_frags, random_state=RANDOM_STATE_VAL)
+        audios = read_frag_audios(df_frags_lang, dir_release)
+
+        for quantize in [False, True]:
+            model = load_model(model_name, quantize)
+            seconds_audio, seconds_elapsed, texts = transcribe_audios(
+                model, audios, whisper_lang_code
+            )
+            wer = word_error_rate(df_frags_lang["text"].tolist(), texts)
+            print(
+                f"{whisper_lang_code} {model_name} "
+                f"{'int8' if quantize else 'fp32'}: "
+                f"{n_frags} fragments, "
+                f"throughput = {seconds_audio / seconds_elapsed:.2f} s audio/s, "
+                f"WER = {wer * 100:.1f}%"
+            )
+
+
+def read_frag_audios(df_frags: pd.DataFrame, dir_release: Path) -> list[np.ndarray]:
+    # Decode each concatenated conversation audio once and return the fragments as
+    # slices, in the order of `df_frags`.
+    audios_full = {
+        path_concat_audio: whisper.load_audio(
+            str(dir_release.joinpath(path_concat_audio))
+        )
+        for path_concat_audio in pd.unique(df_frags["concat_audio_path"])
+    }
+    return [
+        slice_audio(
+            audios_full[row["concat_audio_path"]],
+            row["time_start_rel"],
+            row["time_end_rel"],
+        )
+        for _, row in df_frags.iterrows()
+    ]
+
+
+def transcribe_audios(
+    model: whisper.Whisper, audios: list[np.ndarray], whisper_lang_code: str
+) -> tuple[float, float, list[str]]:
+    # Transcribe the audios with the same options as transcribe_fragments.py. Returns
+    # the total seconds of audio, the seconds elapsed, and the transcripts.
+    texts = []
+    time_start = time.perf_counter()
+    for audio in audios:
+        result = model.transcribe(
+            audio,
+            language=whisper_lang_code,
+            word_timestamps=True,
+            verbose=None,
+            condition_on_previous_text=True,
+            fp16=False,
+        )
+        texts.append(result["text"])
+    seconds_elapsed = time.perf_counter() - time_start
+    seconds_audio = sum(audio.shape[0] for audio in audios) / whisper.audio.SAMPLE_RATE
+    return seconds_audio, seconds_elapsed, texts
+
+
+def word_error_rate(texts_ref: list[str], texts_hyp: list[str]) -> float:
+    # Corpus-level WER: the total word edit distance divided by the total number of
+    # reference words. Texts are normalized (lowercase, no punctuation) first.
+    normalizer = BasicTextNormalizer()
+    n_errors = 0
+    n_words_ref = 0
+    for text_ref, text_hyp in zip(texts_ref, texts_hyp):
+        words_ref = normalizer(text_ref).split()
+        words_hyp = normalizer(text_hyp).split()
+        n_errors += edit_distance(words_ref, words_hyp)
+        n_words_ref += len(words_ref)
+    return n_errors / max(n_words_ref, 1)
+
+
+def edit_distance(words_ref: list[str], words_hyp: list[str]) -> int:
+    # Levenshtein distance between two lists of words, keeping one row of the dynamic
+    # programming table at a time.
+    distances = list(range(len(words_hyp) + 1))
+    for i, word_ref in enumerate(words_ref, start=1):
+        distance_diag, distances[0] = distances[0], i
+        for j, word_hyp in enumerate(words_hyp, start=1):
+            distance_diag, distances[j] = distances[j], min(
+                distances[j] + 1,  # Deletion.
+                distances[j - 1] + 1,  # Insertion.
+                distance_diag + (word_ref != word_hyp),  # Substitution.
+            )
+    return distances[-1]
+
+
+if __name__ == "__main__":
+    main()
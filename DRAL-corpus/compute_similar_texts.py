@@ -1,26 +1,135 @@
 # This script reads the metadata CSV file created by transcribe_fragments.py, and
 # outputs an augmented file with an added "text_most_similar" column. The most similar
-# fragments are found by computing the cosine similarity of the GloVe embeddings of the
-# fragments' text.
+# fragments are found by computing the cosine similarity of the embeddings of the
+# fragments' text (the mean of spaCy's tok2vec outputs over each text's tokens), within
+# each language (English and Spanish). It also writes an approximate nearest neighbor
+# index per language (`text-index-<lang code>.pkl`) for looking up similar texts, see
+# text_index.py.
 #
-# Install spaCy and the English pipeline. For example, on macOS:
+# Install spaCy and the English and Spanish pipelines. For example, on macOS:
 #   pip install -U 'spacy[apple]'
 #   python -m spacy download en_core_web_sm
+#   python -m spacy download es_core_news_sm
 # https://spacy.io/usage#installation
 
-# TODO Compute the similarity for Spanish fragments.
-# TODO Do not drop the Spanish fragments.
 # TODO Accept input and output paths as arguments.
 
+import argparse
+import hashlib
 from pathlib import Path
 
 import en_core_web_sm
+import es_core_news_sm
 import numpy as np
 import pandas as pd
+from text_index import TextIndex
+
+lang_code_to_pipeline = {
+    "EN": en_core_web_sm,
+    "ES": es_core_news_sm,
+}
+
+
+def text_hash(text: str) -> str:
+    return hashlib.sha1(text.encode("utf-8")).hexdigest()
+
+
+def compute_embeddings(
+    nlp,
+    frag_ids: list[str],
+    texts: list[str],
+    path_cache: Path,
+    batch_size: int = 256,
+    n_process: int = 1,
+) -> np.ndarray:
+    # Return an array of shape (n_texts, vector size) with the spaCy document vectors of
+    # the texts. Vectors are cached in a .npy file keyed by fragment ID and text hash,
+    # so only new or changed texts are embedded. The texts are embedded in batches with
+    # nlp.pipe(), running only the "tok2vec" component: the small pipelines have no
+    # static word vectors, so Doc.vector averages the tok2vec outputs, and the other
+    # components (tagger, parser, NER, etc.) do not affect it.
+    hashes = [text_hash(text) for text in texts]
+
+    # Read the cache into a dictionary of fragment ID to (text hash, vector).
+    cache = {}
+    if path_cache.is_file():
+        arr_cache = np.load(path_cache)
+        cache = {
+            frag_id: (hash_, vector)
+            for frag_id, hash_, vector in zip(
+                arr_cache["id"], arr_cache["text_hash"], arr_cache["vector"]
+            )
+        }
+
+    idx_missing = [
+        idx
+        for idx, (frag_id, hash_) in enumerate(zip(frag_ids, hashes))
+        if frag_id not in cache or cache[frag_id][0] != hash_
+    ]
+    print(f"Embedding {len(idx_missing)} of {len(texts)} texts not in the cache.")
+
+    if idx_missing:
+        with nlp.select_pipes(enable=["tok2vec"]):
+            docs = nlp.pipe(
+                [texts[idx] for idx in idx_missing],
+                batch_size=batch_size,
+                n_process=n_process,
+            )
+            for idx, doc in zip(idx_missing, docs):
+                cache[frag_ids[idx]] = (hashes[idx], doc.vector)
+
+        # Write the cache, including entries of fragments not passed to this call.
+        vector_size = len(next(iter(cache.values()))[1])
+        arr_cache = np.array(
+            [(frag_id, hash_, vector) for frag_id, (hash_, vector) in cache.items()],
+            dtype=[
+                ("id", f"U{max(len(frag_id) for frag_id in cache)}"),
+                ("text_hash", "U40"),
+                ("vector", np.float32, (vector_size,)),
+            ],
+        )
+        np.save(path_cache, arr_cache)
+
+    return np.stack([cache[frag_id][1] for frag_id in frag_ids]).astype(np.float32)
+
+
+def most_similar(
+    embeddings: np.ndarray, n_most_similar: int, block_size: int = 4096
+) -> np.ndarray:
+    # Return an array of shape (n, n_most_similar) with the row indices of the
+    # embeddings with the highest cosine similarity to each embedding, most similar
+    # first, excluding the embedding itself. The embeddings are normalized once, so the
+    # cosine similarities are a matrix product, computed `block_size` rows at a time to
+    # bound memory. The top rows are selected with a partial sort (argpartition), and
+    # only those are fully sorted.
+    embeddings_norm = embeddings.astype(np.float32)
+    norms = np.linalg.norm(embeddings_norm, axis=1, keepdims=True)
+    embeddings_norm /= np.where(norms == 0, 1, norms)  # Empty vectors stay zero.
+
+    n_embeddings = embeddings_norm.shape[0]
+    n_most_similar = min(n_most_similar, n_embeddings - 1)
+    idx_most_similar = np.empty((n_embeddings, n_most_similar), dtype=np.int64)
+    if n_most_similar <= 0:
+        return idx_most_similar
+
+    for block_start in range(0, n_embeddings, block_size):
+        block_end = min(block_start + block_size, n_embeddings)
+        similarity = embeddings_norm[block_start:block_end] @ embeddings_norm.T
+
+        # Exclude the similarity of each embedding to itself.
+        rows = np.arange(block_end - block_start)
+        similarity[rows, rows + block_start] = -np.inf
+
+        idx_top = np.argpartition(-similarity, n_most_similar - 1, axis=1)[
+            :, :n_most_similar
+        ]
+        similarity_top = np.take_along_axis(similarity, idx_top, axis=1)
+        order = np.argsort(-similarity_top, axis=1, kind="stable")
+        idx_most_similar[block_start:block_end] = np.take_along_axis(
+            idx_top, order, axis=1
+        )
 
-
-def cosine_similarity(v1: np.ndarray, v2: np.ndarray):
-    return np.dot(v1, v2) / (np.linalg.norm(v1) * np.linalg.norm(v2))
+    return idx_most_similar
 
 
 def drop_with_empty_text(df_frags):
@@ -34,6 +143,18 @@ def drop_with_empty_text(df_frags):
 
 
 def main() -> None:
+    parser = argparse.ArgumentParser(
+        description="Find the fragments with the most similar texts.",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+    )
+    parser.add_argument(
+        "--n_process",
+        help="Number of processes for computing text embeddings with spaCy.",
+        type=int,
+        default=1,
+    )
+    args = parser.parse_args()
+
     dir_this_file = Path(__file__).parent.resolve()
     dir_release = dir_this_file.joinpath("release")
     path_input_metadata = dir_release.joinpath("fragments-short-matlab-transcribed.csv")
@@ -43,37 +164,55 @@ def main() -> None:
 
     df_frags = pd.read_csv(path_input_metadata)
 
-    df_frags_en = df_frags[df_frags["lang_code"] == "EN"]
+    df_frags_by_lang = []
+    for lang_code, pipeline in lang_code_to_pipeline.items():
+        df_frags_lang = df_frags[df_frags["lang_code"] == lang_code]
+
+        df_frags_lang = drop_with_empty_text(df_frags_lang)
 
-    df_frags_en = drop_with_empty_text(df_frags_en)
+        # Load default trained pipeline for the language.
+        nlp = pipeline.load()
+        pipeline_name = f"{nlp.meta['lang']}_{nlp.meta['name']}"
 
-    # Load default trained pipeline for English.
-    nlp = en_core_web_sm.load()
+        # Compute the embedding of each row, the mean of the tok2vec tensor of its
+        # tokens (see compute_embeddings), stacked into a matrix. Embeddings of unchanged
+        # texts are read from the cache.
+        path_embeddings_cache = dir_release.joinpath(
+            f"text-embeddings-{pipeline_name}.npy"
+        )
+        embeddings = compute_embeddings(
+            nlp,
+            df_frags_lang["id"].to_list(),
+            df_frags_lang["text"].to_list(),
+            path_embeddings_cache,
+            n_process=args.n_process,
+        )
 
-    # Compute GloVe embeddings for each row.
-    embeddings = df_frags_en["text"].apply(lambda x: nlp(x).vector)
+        n_most_similar_to_print = 4
 
-    n_most_similar_to_print = 4
+        idx_most_similar = most_similar(embeddings, n_most_similar_to_print)
 
-    for label, content in embeddings.items():
-        print(label)
-        # Compute the similarity of the current row with all others.
-        similarity = embeddings.apply(lambda x: cosine_similarity(x, content))
-        # Sort the values and get the indices.
-        similar_sorted = similarity.sort_values(ascending=False).index
-        # Get the three most similar rows.
-        n_most_similar = similar_sorted[1 : n_most_similar_to_print + 1].tolist()
         # Create a string with the format "<id_1>: <text_1>; <id_2>: <text_2>; ...;
         # <id_n>: <text_n>"
-        similar_texts_str = "; ".join(
-            [
-                f"{df_frags_en.at[index, 'id']}: {df_frags_en.at[index, 'text']}"
-                for index in n_most_similar
-            ]
+        ids_and_texts = (df_frags_lang["id"] + ": " + df_frags_lang["text"]).to_numpy()
+        df_frags_lang["text_most_similar"] = [
+            "; ".join(ids_and_texts[idx_row]) for idx_row in idx_most_similar
+        ]
+        df_frags_by_lang.append(df_frags_lang)
+
+        # Persist an approximate nearest neighbor index for lookups (see text_index.py).
+        path_index = dir_release.joinpath(f"text-index-{lang_code}.pkl")
+        index = TextIndex(
+            df_frags_lang["id"].to_list(),
+            df_frags_lang["text"].to_list(),
+            embeddings,
+            pipeline_name,
         )
-        df_frags_en.at[label, "text_most_similar"] = similar_texts_str
+        index.save(path_index)
+        print(f"Wrote text index to: {path_index}")
 
-    df_frags_en.to_csv(path_output_metadata, index=False)
+    df_frags_with_similarity = pd.concat(df_frags_by_lang).sort_values("id")
+    df_frags_with_similarity.to_csv(path_output_metadata, index=False)
 
 
 if __name__ == "__main__":
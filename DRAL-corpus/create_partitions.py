@@ -6,6 +6,7 @@ import random
 from pathlib import Path
 from typing import Tuple
 
+import numpy as np
 import pandas as pd
 
 RANDOM_STATE_VAL = 42
@@ -30,10 +31,33 @@ def main():
         help="Path to directory to write partitioned metadata to.",
         default=dir_this_file.joinpath("release/features"),
     )
+    parser.add_argument(
+        "-k",
+        "--n_folds",
+        help="If specified, instead of a single training and test split, write K "
+        "speaker-independent folds for cross-validation to folds-<K>.npz.",
+        type=int,
+        default=None,
+    )
     args = parser.parse_args()
 
     path_metadata = args.path_metadata
-    dir_output = args.dir_output
+    dir_output = Path(args.dir_output)
+
+    if args.n_folds is not None:
+        path_output_folds = dir_output.joinpath(f"folds-{args.n_folds}.npz")
+        if path_output_folds.exists():
+            print("Stopped because the folds file already exists.")
+            return
+        frag_ids_EN, frag_ids_ES, folds = partition_folds(path_metadata, args.n_folds)
+        np.savez(
+            path_output_folds,
+            frag_ids_EN=frag_ids_EN,
+            frag_ids_ES=frag_ids_ES,
+            folds=folds,
+        )
+        print(f"Wrote folds to: {path_output_folds}")
+        return
 
     path_output_EN_train = dir_output.joinpath("EN-train.csv")
     path_output_EN_test = dir_output.joinpath("EN-test.csv")
@@ -120,5 +144,49 @@ def partition_data(
     return df_EN_train, df_EN_test, df_ES_train, df_ES_test
 
 
+def partition_folds(
+    path_metadata: Path, n_folds: int = 5
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    # Partition fragments into `n_folds` speaker-independent folds for cross-validation,
+    # balanced by number of fragments. Like partition_data, the speakers are sorted by
+    # their number of fragments, descending order, then each speaker is added to the
+    # fold with the fewest fragments so far.
+    #
+    # Returns three arrays over a fixed fragment order (EN fragment IDs, sorted): the EN
+    # fragment IDs, the IDs of their ES translations, and the fold (0 to n_folds - 1)
+    # of each pair. The training and test row indices of a fold are then
+    # `np.flatnonzero(folds != k)` and `np.flatnonzero(folds == k)`.
+
+    assert n_folds > 1
+
+    df_frags = pd.read_csv(path_metadata, index_col="id")
+
+    df_frags_EN = df_frags[df_frags["lang_code"] == "EN"].sort_index()
+
+    speaker_codes, _ = pd.factorize(df_frags_EN["participant_id_unique"])
+    speaker_frags_count = np.bincount(speaker_codes)
+
+    fold_frags_count = np.zeros(n_folds, dtype=np.int64)
+    speaker_folds = np.empty(speaker_frags_count.size, dtype=np.int8)
+    for speaker_code in np.argsort(-speaker_frags_count, kind="stable"):
+        fold = fold_frags_count.argmin()
+        speaker_folds[speaker_code] = fold
+        fold_frags_count[fold] += speaker_frags_count[speaker_code]
+
+    folds = speaker_folds[speaker_codes]
+
+    # Print some debugging info.
+    n_samples_total = df_frags_EN.shape[0]
+    for fold, n_samples_fold in enumerate(fold_frags_count):
+        print(
+            f"fold {fold}: {n_samples_fold} "
+            f"({n_samples_fold / n_samples_total * 100:.1f}%)"
+        )
+
+    frag_ids_EN = df_frags_EN.index.to_numpy(dtype=str)
+    frag_ids_ES = df_frags_EN["trans_id"].to_numpy(dtype=str)
+    return frag_ids_EN, frag_ids_ES, folds
+
+
 if __name__ == "__main__":
     main()
@@ -0,0 +1,253 @@
+# Export the fragments of a release to size-bounded tar shards (WebDataset-style), so
+# consumers can stream the corpus shard by shard, or randomly access single fragments,
+# without downloading and unpacking it all.
+#
+# Each fragment is stored as two consecutive members with the fragment ID as key:
+# `<id>.wav` (its audio) and `<id>.json` (its metadata row). An index CSV per fragment
+# type maps each fragment ID to its shard and to the byte offset and size of both
+# members, e.g. for fragments-short:
+#
+#   dir_output/fragments-short-00000.tar
+#   dir_output/fragments-short-00001.tar
+#   ...
+#   dir_output/fragments-short-index.csv
+#
+# A fragment's audio can then be read with a single seek, see read_member. The output
+# directory can be uploaded as is to the Hugging Face hub with --repo_id, or used
+# locally as a stand-in for it.
+
+import argparse
+import io
+import json
+import math
+import tarfile
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+import pandas as pd
+
+TAR_BLOCK_SIZE = tarfile.BLOCKSIZE
+INDEX_COLUMNS = ["id", "shard", "offset_wav", "size_wav", "offset_json", "size_json"]
+
+
+def main():
+    dir_this_file = Path(__file__).parent.resolve()
+
+    parser = argparse.ArgumentParser(
+        description="Pack release fragments and their metadata into size-bounded tar "
+        "shards, with an index of each fragment's shard and byte offsets.",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+    )
+    parser.add_argument(
+        "-i",
+        "--dir_release",
+        help="Release directory, output of make_release.py.",
+        default=dir_this_file.joinpath("release"),
+    )
+    parser.add_argument(
+        "-o",
+        "--dir_output",
+        help="Output directory for the shards and indexes.",
+        default=dir_this_file.joinpath("release-shards"),
+    )
+    parser.add_argument(
+        "--frag_types",
+        help="Fragment types to export.",
+        nargs="+",
+        choices=["short", "long"],
+        default=["short", "long"],
+    )
+    parser.add_argument(
+        "--shard_size_mb",
+        help="Maximum size of a shard in megabytes. A fragment larger than this is put "
+        "in a shard of its own.",
+        type=float,
+        default=256,
+    )
+    parser.add_argument(
+        "--n_workers",
+        help="Number of processes writing shards.",
+        type=int,
+        default=4,
+    )
+    parser.add_argument(
+        "--repo_id",
+        help="Hugging Face dataset repository to upload the output directory to, e.g. "
+        "'jonavila/DRAL'. If not given, nothing is uploaded.",
+        default=None,
+    )
+    args = parser.parse_args()
+
+    dir_release = Path(args.dir_release)
+    dir_output = Path(args.dir_output)
+    dir_output.mkdir(parents=True, exist_ok=True)
+
+    for frag_type in args.frag_types:
+        name = f"fragments-{frag_type}"
+        df_frags = pd.read_csv(dir_release.joinpath(f"{name}.csv"), dtype=str)
+        df_index = export_shards(
+            df_frags,
+            dir_release.joinpath(name),
+            dir_output,
+            name,
+            shard_size=round(args.shard_size_mb * 1e6),
+            n_workers=args.n_workers,
+        )
+        path_index = dir_output.joinpath(f"{name}-index.csv")
+        df_index.to_csv(path_index, index=False)
+        print(
+            f"Wrote {df_index.shape[0]} fragments to "
+            f"{df_index['shard'].nunique()} shards, index: {path_index}"
+        )
+
+    if args.repo_id is not None:
+        # Imported here, so exporting does not require huggingface_hub.
+        from huggingface_hub import HfApi
+
+        HfApi().upload_folder(
+            folder_path=str(dir_output),
+            repo_id=args.repo_id,
+            path_in_repo=".",
+            repo_type="dataset",
+        )
+        print(f"Uploaded {dir_output} to: {args.repo_id}")
+
+
+def export_shards(
+    df_frags: pd.DataFrame,
+    dir_audio: Path,
+    dir_output: Path,
+    name: str,
+    shard_size: int = 256_000_000,
+    n_workers: int = 4,
+) -> pd.DataFrame:
+    """Pack fragment audios and metadata rows into tar shards, written in parallel.
+
+    Args:
+        df_frags (pd.DataFrame): Fragment metadata with an "id" column. Each row is
+            stored as the fragment's JSON member.
+        dir_audio (Path): Directory with the fragment audios, named "<id>.wav".
+        dir_output (Path): Output directory for the shards.
+        name (str): Shard name prefix, e.g. "fragments-short".
+        shard_size (int, optional): Maximum shard size in bytes. Defaults to 256 MB.
+        n_workers (int, optional): Number of processes writing shards. Defaults to 4.
+
+    Returns:
+        pd.DataFrame: Index with the columns of INDEX_COLUMNS, one row per fragment.
+    """
+    # Missing values are written as null: NaN is not valid JSON, and strict readers
+    # reject it.
+    records = (
+        df_frags.astype(object).where(df_frags.notna(), None).to_dict(orient="records")
+    )
+    metadatas = [
+        json.dumps(record, allow_nan=False).encode("utf-8") for record in records
+    ]
+    paths_audio = [dir_audio.joinpath(f"{record['id']}.wav") for record in records]
+
+    # Plan the shards up front, from the file sizes, so they can be written
+    # independently and the output does not depend on the number of workers.
+    member_sizes = [
+        tar_member_size(path_audio.stat().st_size) + tar_member_size(len(metadata))
+        for path_audio, metadata in zip(paths_audio, metadatas)
+    ]
+    # Leave room for the end-of-archive blocks and the padding to a full tar record.
+    shard_bounds = plan_shards(
+        member_sizes, shard_size - 2 * TAR_BLOCK_SIZE - tarfile.RECORDSIZE
+    )
+
+    n_digits = max(5, len(str(len(shard_bounds) - 1)))
+    jobs = [
+        (
+            dir_output.joinpath(f"{name}-{shard_num:0{n_digits}d}.tar"),
+            [record["id"] for record in records[start:end]],
+            paths_audio[start:end],
+            metadatas[start:end],
+        )
+        for shard_num, (start, end) in enumerate(shard_bounds)
+    ]
+    with ProcessPoolExecutor(max_workers=n_workers) as executor:
+        index_rows = [
+            row
+            for shard_rows in executor.map(write_shard, *zip(*jobs))
+            for row in shard_rows
+        ]
+    return pd.DataFrame(index_rows, columns=INDEX_COLUMNS)
+
+
+def tar_member_size(size: int) -> int:
+    # Bytes taken by a tar member: a header block, plus its data padded to full blocks.
+    return TAR_BLOCK_SIZE + math.ceil(size / TAR_BLOCK_SIZE) * TAR_BLOCK_SIZE
+
+
+def plan_shards(member_sizes: list[int], shard_size: int) -> list[tuple[int, int]]:
+    # Greedily group consecutive fragments into shards of at most `shard_size` bytes.
+    # Returns the start and end (exclusive) position of each shard's fragments.
+    shard_bounds = []
+    start = 0
+    size_shard = 0
+    for position, size in enumerate(member_sizes):
+        if position > start and size_shard + size > shard_size:
+            shard_bounds.append((start, position))
+            start = position
+            size_shard = 0
+        size_shard += size
+    if start < len(member_sizes):
+        shard_bounds.append((start, len(member_sizes)))
+    return shard_bounds
+
+
+def write_shard(
+    path_shard: Path,
+    frag_ids: list[str],
+    paths_audio: list[Path],
+    metadatas: list[bytes],
+) -> list[tuple]:
+    # Write one shard and return its index rows.
+    index_rows = []
+    with tarfile.open(path_shard, "w", format=tarfile.USTAR_FORMAT) as tar:
+        for frag_id, path_audio, metadata in zip(frag_ids, paths_audio, metadatas):
+            with open(path_audio, "rb") as file_audio:
+                offset_wav, size_wav = add_member(
+                    tar, f"{frag_id}.wav", file_audio, path_audio.stat().st_size
+                )
+            offset_json, size_json = add_member(
+                tar, f"{frag_id}.json", io.BytesIO(metadata), len(metadata)
+            )
+            index_rows.append(
+                (frag_id, path_shard.name, offset_wav, size_wav, offset_json, size_json)
+            )
+    return index_rows
+
+
+def add_member(
+    tar: tarfile.TarFile, name: str, fileobj: io.IOBase, size: int
+) -> tuple[int, int]:
+    # Add a member to a tar file being written and return the byte offset and size of
+    # its data.
+    info = tarfile.TarInfo(name)
+    info.size = size
+    tar.addfile(info, fileobj)
+    # The data ends at the current offset, padded to full blocks.
+    offset = tar.offset - math.ceil(size / TAR_BLOCK_SIZE) * TAR_BLOCK_SIZE
+    return offset, size
+
+
+def read_member(path_shard: Path, offset: int, size: int) -> bytes:
+    """Read the data of one shard member, e.g. a fragment's audio, with a single seek.
+
+    Args:
+        path_shard (Path): Path to the shard, e.g. from the "shard" column of an index.
+        offset (int): Byte offset of the member's data, e.g. "offset_wav".
+        size (int): Size of the member's data in bytes, e.g. "size_wav".
+
+    Returns:
+        bytes: The member's data.
+    """
+    with open(path_shard, "rb") as file:
+        file.seek(offset)
+        return file.read(size)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,16 +1,51 @@
 # This scripts reads metadata files created by make_release.py and outputs a stats text
-# file to the same release directory.
-
+# file and the same stats as JSON to the same release directory.
+#
+# Every count and duration statistic of a fragment table is computed from a single
+# groupby over (language, original or re-enacted, EN-ES pair, partition), so the
+# sections below only sum over the small aggregated table. Audio durations are also
+# totaled from the WAV headers of the release audio files, read in parallel.
+
+import argparse
+import json
+import struct
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
-from typing import TextIO
+from typing import Optional, TextIO
 
 import pandas as pd
 import shared
 
+# Groups of the aggregated fragment table.
+AGG_KEYS = ["lang_code", "original_or_reenacted", "is_en_es_pair", "set"]
+# Partition of fragments without partition metadata (e.g. fragments-short-sets.csv,
+# created by add_partition_metadata_release_8.py).
+SET_UNASSIGNED = "unassigned"
+
 
 def main():
     dir_this_file = Path(__file__).parent.resolve()
-    dir_dral_release = dir_this_file.joinpath("release")
+
+    parser = argparse.ArgumentParser(
+        description="Output stats of a DRAL release to stats.txt and stats.json in the "
+        "release directory.",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+    )
+    parser.add_argument(
+        "-i",
+        "--dir_release",
+        help="Release directory, output of make_release.py.",
+        default=dir_this_file.joinpath("release"),
+    )
+    parser.add_argument(
+        "--n_threads",
+        help="Number of threads reading WAV headers.",
+        type=int,
+        default=16,
+    )
+    args = parser.parse_args()
+
+    dir_dral_release = Path(args.dir_release)
 
     conv_csv_path = dir_dral_release.joinpath("conversation.csv")
     participant_csv_path = dir_dral_release.joinpath("participant.csv")
@@ -20,194 +55,290 @@ def main():
     # Read CSV files into pandas DataFrames.
     df_conv = pd.read_csv(conv_csv_path)
     df_participant = pd.read_csv(participant_csv_path)
-    df_frag_short = pd.read_csv(short_frags_csv_path)
-    df_frag_long = pd.read_csv(long_frags_csv_path)
-
-    # Convert short fragments duration columns to pandas Timedelta.
-    df_frag_short["time_start"] = pd.to_timedelta(df_frag_short["time_start"])
-    df_frag_short["time_end"] = pd.to_timedelta(df_frag_short["time_end"])
-    df_frag_short["duration"] = pd.to_timedelta(df_frag_short["duration"])
+    df_frag_short = read_fragments(
+        short_frags_csv_path, dir_dral_release.joinpath("fragments-short-sets.csv")
+    )
+    df_frag_long = read_fragments(
+        long_frags_csv_path, dir_dral_release.joinpath("fragments-long-sets.csv")
+    )
 
-    # Convert long fragments duration columns to pandas Timedelta.
-    df_frag_long["time_start"] = pd.to_timedelta(df_frag_long["time_start"])
-    df_frag_long["time_end"] = pd.to_timedelta(df_frag_long["time_end"])
-    df_frag_long["duration"] = pd.to_timedelta(df_frag_long["duration"])
+    # Total the audio durations from the WAV headers, in parallel.
+    paths_audio = {
+        "conversations": [
+            dir_dral_release.joinpath("recordings", f"{id}.wav") for id in df_conv["id"]
+        ],
+        "fragments_short": [
+            dir_dral_release.joinpath("fragments-short", f"{id}.wav")
+            for id in df_frag_short["id"]
+        ],
+        "fragments_long": [
+            dir_dral_release.joinpath("fragments-long", f"{id}.wav")
+            for id in df_frag_long["id"]
+        ],
+    }
+    audio_durations = {
+        name: total_wav_durations(paths, args.n_threads)
+        for name, paths in paths_audio.items()
+    }
+
+    df_agg_short = aggregate_fragments(df_frag_short)
+    df_agg_long = aggregate_fragments(df_frag_long)
+    stats = {
+        "conversations": {
+            **summarize_conversations(df_conv),
+            "audio": audio_durations["conversations"],
+        },
+        "participants": {"count_unique": int(df_participant["id_unique"].nunique())},
+        "fragments_short": {
+            "all": summarize_fragments(df_agg_short),
+            "en_es_only": summarize_fragments(
+                df_agg_short[df_agg_short["is_en_es_pair"]]
+            ),
+            "audio": audio_durations["fragments_short"],
+            "groups": groups_to_records(df_agg_short),
+        },
+        "fragments_long": {
+            "all": summarize_fragments(df_agg_long),
+            "en_es_only": summarize_fragments(
+                df_agg_long[df_agg_long["is_en_es_pair"]]
+            ),
+            "audio": audio_durations["fragments_long"],
+            "groups": groups_to_records(df_agg_long),
+        },
+    }
 
     path_output = dir_dral_release.joinpath("stats.txt")
     with open(path_output, "w") as file_output:
         print_header("conversations", file_output)
-        print_conversations(df_conv, file_output)
+        print_conversations(stats["conversations"], file_output)
 
         print_header("participants", file_output)
-        print_participants(df_participant, file_output)
+        file_output.write(f"count (unique) = {stats['participants']['count_unique']}\n")
 
         print_header('short fragments ("phrases")', file_output)
-        print_fragments_short(df_frag_short, file_output)
+        print_fragments(
+            stats["fragments_short"]["all"],
+            file_output,
+            stats["fragments_short"]["audio"],
+        )
 
         print_header('short fragments ("phrases") EN-ES only', file_output)
-        print_fragments_short(df_frag_short, file_output, en_es_only=True)
+        print_fragments(stats["fragments_short"]["en_es_only"], file_output)
 
         print_header('long fragments ("re-enactments")', file_output)
-        print_fragments_long(df_frag_long, file_output)
+        print_fragments(
+            stats["fragments_long"]["all"],
+            file_output,
+            stats["fragments_long"]["audio"],
+        )
 
         print_header('long fragments ("phrases") EN-ES only', file_output)
-        print_fragments_long(df_frag_long, file_output, en_es_only=True)
+        print_fragments(stats["fragments_long"]["en_es_only"], file_output)
 
     print(f"Wrote output to: {path_output}")
 
+    path_output_json = dir_dral_release.joinpath("stats.json")
+    with open(path_output_json, "w") as file_output:
+        json.dump(stats_to_json(stats), file_output, indent=2)
+    print(f"Wrote output to: {path_output_json}")
 
-def drop_non_en_es(df_frag_in: pd.DataFrame) -> pd.DataFrame:
-    df_frag = df_frag_in.copy()
-    is_en_with_es_pair = (df_frag["lang_code"] == "EN") & (
-        df_frag["trans_id"].str.startswith("ES")
-    )
-    is_es_with_en_pair = (df_frag["lang_code"] == "ES") & (
-        df_frag["trans_id"].str.startswith("EN")
-    )
-    is_part_of_pair = is_en_with_es_pair | is_es_with_en_pair
-    df_frag = df_frag[is_part_of_pair]
-    return df_frag
 
-
-def print_header(header: str, file_output: TextIO, decorator: str = "*") -> None:
-    # Print a string surrounded by a decorator.
-    decorator_len = 10
-    file_output.write(
-        f"{decorator * decorator_len} {header} {decorator * decorator_len}\n"
+def read_fragments(path_frags: Path, path_sets: Path) -> pd.DataFrame:
+    # Read fragment metadata, with its duration as pandas Timedelta and a column "set"
+    # with the partition of each fragment, if partition metadata exists.
+    df_frag = pd.read_csv(
+        path_frags,
+        usecols=["id", "lang_code", "original_or_reenacted", "duration", "trans_id"],
     )
+    df_frag["duration"] = pd.to_timedelta(df_frag["duration"])
+    if path_sets.exists():
+        df_sets = pd.read_csv(path_sets, usecols=["id", "set"])
+        df_frag = df_frag.merge(df_sets, on="id", how="left")
+        df_frag["set"] = df_frag["set"].fillna(SET_UNASSIGNED)
+    else:
+        df_frag["set"] = SET_UNASSIGNED
+    return df_frag
 
 
-def print_conversations(df_conv: pd.DataFrame, file_output: TextIO) -> None:
-    # Print number of original conversations.
-    n_og_conversations = df_conv[
-        df_conv["original_or_reenacted"] == shared.CONV_CODE_ORIGINAL
-    ].shape[0]
-    file_output.write(f"count (original) = {n_og_conversations}\n")
-
-    # Print number of original conversations by language.
-    for lang_code in shared.LANG_CODES:
-        id_pattern = rf"^{lang_code}.*"
-        series_conv_in_lang = df_conv["id"].str.fullmatch(id_pattern)
-        n_in_lang = series_conv_in_lang.sum()
-        file_output.write(f"\t{lang_code} count = {n_in_lang}\n")
-
-    # Print number of re-enacted conversations.
-    n_re_conversations = df_conv[
-        df_conv["original_or_reenacted"] == shared.CONV_CODE_REENACTED
-    ].shape[0]
-    file_output.write(f"count (re-enacted) = {n_re_conversations}\n")
-
-    # Print number of re-enacted conversations by language.
-    for lang_code in shared.LANG_CODES:
-        id_pattern = rf"^{lang_code}.*"
-        series_conv_in_lang = df_conv["id"].str.fullmatch(id_pattern)
-        n_in_lang = series_conv_in_lang.sum()
-        file_output.write(f"\t{lang_code} count = {n_in_lang}\n")
-
-
-def print_participants(df_participant: pd.DataFrame, file_output: TextIO) -> None:
-    # Print number of unique participants.
-    n_unique_participant_ids = df_participant["id_unique"].nunique()
-    file_output.write(f"count (unique) = {n_unique_participant_ids}\n")
+def is_en_es_pair(df_frag: pd.DataFrame) -> pd.Series:
+    # Whether each fragment is part of an EN-ES pair.
+    trans_lang_code = df_frag["trans_id"].str[:2]
+    is_en_with_es_pair = (df_frag["lang_code"] == "EN") & (trans_lang_code == "ES")
+    is_es_with_en_pair = (df_frag["lang_code"] == "ES") & (trans_lang_code == "EN")
+    return is_en_with_es_pair | is_es_with_en_pair
 
 
-def print_fragments_short(
-    df_frag_short: pd.DataFrame, file_output: TextIO, en_es_only: bool = False
-) -> None:
-    # Optionally exclude fragments that are not from EN-ES pairs. (DRAL 8.0 does not
-    # include any short fragments pairs other than EN-ES, so this isn't very useful.)
-    if en_es_only:
-        df_frag_short = drop_non_en_es(df_frag_short)
-
-    # Print number of original or re-enacted short fragments.
-    n_frags = df_frag_short.shape[0]
-    file_output.write(f"count (original or re-enacted) = {n_frags}\n")
-
-    # Print number of original or re-enacted short fragments by language.
-    for lang_code in shared.LANG_CODES:
-        id_pattern = rf"^{lang_code}.*"
-        series_frags_in_lang = df_frag_short["id"].str.fullmatch(id_pattern)
-        n_in_lang = series_frags_in_lang.sum()
-        file_output.write(f"\t{lang_code} count = {n_in_lang}\n")
-
-    # Print number of original short fragments.
-    n_frags_original = df_frag_short[
-        df_frag_short["original_or_reenacted"] == "OG"
-    ].shape[0]
-    file_output.write(f"count (original) = {n_frags_original}\n")
+def aggregate_fragments(df_frag: pd.DataFrame) -> pd.DataFrame:
+    # Count fragments and compute duration statistics in one pass, per group of
+    # AGG_KEYS. Returns one row per group with the columns of AGG_KEYS and "count",
+    # "duration_total", "duration_min", and "duration_max".
+    df_frag = df_frag.assign(is_en_es_pair=is_en_es_pair(df_frag))
+    df_agg = (
+        df_frag.groupby(AGG_KEYS)["duration"]
+        .agg(["count", "sum", "min", "max"])
+        .reset_index()
+    )
+    return df_agg.rename(
+        columns={
+            "sum": "duration_total",
+            "min": "duration_min",
+            "max": "duration_max",
+        }
+    )
 
-    # Print number of re-enacted short fragments.
-    n_frags_reenacted = df_frag_short[
-        df_frag_short["original_or_reenacted"] == "RE"
-    ].shape[0]
-    file_output.write(f"count (re-enacted) = {n_frags_reenacted}\n")
 
-    file_output.write("duration\n")
+def summarize_fragments(df_agg: pd.DataFrame) -> dict:
+    # Combine groups of an aggregated fragment table into the stats of a section.
+    n_frags = int(df_agg["count"].sum())
+    count_by_lang = df_agg.groupby("lang_code")["count"].sum()
+    count_by_conv_code = df_agg.groupby("original_or_reenacted")["count"].sum()
+    duration_total = df_agg["duration_total"].sum()
+    return {
+        "count": n_frags,
+        "count_by_lang": {
+            lang_code: int(count_by_lang.get(lang_code, 0))
+            for lang_code in shared.LANG_CODES
+        },
+        "count_original": int(count_by_conv_code.get(shared.CONV_CODE_ORIGINAL, 0)),
+        "count_reenacted": int(count_by_conv_code.get(shared.CONV_CODE_REENACTED, 0)),
+        "duration": {
+            "total": duration_total,
+            "mean": duration_total / n_frags if n_frags else pd.NaT,
+            "minimum": df_agg["duration_min"].min(),
+            "maximum": df_agg["duration_max"].max(),
+        },
+    }
+
+
+def summarize_conversations(df_conv: pd.DataFrame) -> dict:
+    # Count conversations per original or re-enacted and language, in one pass. The
+    # language is the prefix of the conversation ID, e.g. "EN" in "EN_001".
+    count = df_conv.groupby(
+        [df_conv["original_or_reenacted"], df_conv["id"].str.split("_").str[0]]
+    ).size()
+    stats = {}
+    for name, conv_code in [
+        ("original", shared.CONV_CODE_ORIGINAL),
+        ("reenacted", shared.CONV_CODE_REENACTED),
+    ]:
+        stats[f"count_{name}"] = int(count.get(conv_code, pd.Series(dtype=int)).sum())
+        stats[f"count_{name}_by_lang"] = {
+            lang_code: int(count.get((conv_code, lang_code), 0))
+            for lang_code in shared.LANG_CODES
+        }
+    return stats
+
+
+def groups_to_records(df_agg: pd.DataFrame) -> list[dict]:
+    # Aggregated fragment table as JSON records, with durations in seconds.
+    df_records = df_agg.copy()
+    for col in ["duration_total", "duration_min", "duration_max"]:
+        df_records[col] = df_records[col].dt.total_seconds()
+    return df_records.to_dict(orient="records")
+
+
+def wav_duration(path_wav: Path) -> Optional[float]:
+    # Read the duration in seconds of a WAV file from its header, without reading the
+    # samples. Returns None if the file does not exist or is not a valid WAV file.
+    try:
+        with open(path_wav, "rb") as file:
+            riff, _, wave = struct.unpack("<4sI4s", file.read(12))
+            if riff != b"RIFF" or wave != b"WAVE":
+                return None
+            byte_rate = None
+            # Walk the chunks until the data chunk, which follows the format chunk.
+            while True:
+                chunk_header = file.read(8)
+                if len(chunk_header) < 8:
+                    return None
+                chunk_id, chunk_size = struct.unpack("<4sI", chunk_header)
+                if chunk_id == b"fmt ":
+                    fmt = file.read(chunk_size)
+                    (byte_rate,) = struct.unpack("<I", fmt[8:12])
+                    file.seek(chunk_size % 2, 1)
+                elif chunk_id == b"data":
+                    return chunk_size / byte_rate if byte_rate else None
+                else:
+                    # Chunks are padded to an even size.
+                    file.seek(chunk_size + chunk_size % 2, 1)
+    except (OSError, struct.error):
+        return None
+
+
+def total_wav_durations(paths_wav: list[Path], n_threads: int = 16) -> dict:
+    # Total the durations of WAV files, reading their headers in parallel. Files that
+    # are missing or unreadable are counted, not totaled.
+    with ThreadPoolExecutor(max_workers=n_threads) as executor:
+        durations = list(executor.map(wav_duration, paths_wav))
+    durations_found = [duration for duration in durations if duration is not None]
+    return {
+        "count_files": len(durations_found),
+        "count_missing": len(durations) - len(durations_found),
+        "duration_total": pd.Timedelta(seconds=sum(durations_found)),
+    }
+
+
+def stats_to_json(stats):
+    # Convert Timedelta values to seconds, recursively, so the stats are serializable.
+    if isinstance(stats, dict):
+        return {key: stats_to_json(value) for key, value in stats.items()}
+    if isinstance(stats, list):
+        return [stats_to_json(value) for value in stats]
+    if stats is pd.NaT:
+        return None
+    if isinstance(stats, pd.Timedelta):
+        return stats.total_seconds()
+    if hasattr(stats, "item"):
+        # NumPy scalars.
+        return stats.item()
+    return stats
 
-    # Print total duration of short fragments.
-    duration_total = df_frag_short["duration"].sum()
-    file_output.write(f"\ttotal = {duration_total}\n")
 
-    # Print mean duration of short fragments.
-    duration_mean = df_frag_short["duration"].mean()
-    file_output.write(f"\tmean = {duration_mean}\n")
+def print_header(header: str, file_output: TextIO, decorator: str = "*") -> None:
+    # Print a string surrounded by a decorator.
+    decorator_len = 10
+    file_output.write(
+        f"{decorator * decorator_len} {header} {decorator * decorator_len}\n"
+    )
 
-    # Print minimum duration of short fragments.
-    duration_min = df_frag_short["duration"].min()
-    file_output.write(f"\tminimum = {duration_min}\n")
 
-    # Print maximum duration of short fragments.
-    duration_max = df_frag_short["duration"].max()
-    file_output.write(f"\tmaximum = {duration_max}\n")
+def print_conversations(stats_conv: dict, file_output: TextIO) -> None:
+    # Print number of original and re-enacted conversations, by language.
+    for name, label in [("original", "original"), ("reenacted", "re-enacted")]:
+        file_output.write(f"count ({label}) = {stats_conv[f'count_{name}']}\n")
+        for lang_code, n_in_lang in stats_conv[f"count_{name}_by_lang"].items():
+            file_output.write(f"\t{lang_code} count = {n_in_lang}\n")
+    print_audio(stats_conv["audio"], file_output)
 
 
-def print_fragments_long(
-    df_frag_long: pd.DataFrame, file_output: TextIO, en_es_only: bool = False
+def print_fragments(
+    stats_frags: dict, file_output: TextIO, stats_audio: Optional[dict] = None
 ) -> None:
-    # Optionally exclude fragments that are not from EN-ES pairs.
-    if en_es_only:
-        df_frag_long = drop_non_en_es(df_frag_long)
-
-    # Print number of original or re-enacted long fragments.
-    n_frags = df_frag_long.shape[0]
-    file_output.write(f"count (original or re-enacted) =  {n_frags}\n")
-
-    # Print number of original or re-enacted long fragments by language.
-    for lang_code in shared.LANG_CODES:
-        id_pattern = rf"^{lang_code}.*"
-        df_frags_in_lang = df_frag_long["id"].str.fullmatch(id_pattern)
-        n_in_lang = df_frags_in_lang.sum()
+    # Print number of original or re-enacted fragments, by language.
+    file_output.write(f"count (original or re-enacted) = {stats_frags['count']}\n")
+    for lang_code, n_in_lang in stats_frags["count_by_lang"].items():
         file_output.write(f"\t{lang_code} count = {n_in_lang}\n")
 
-    # Print number of original long fragments.
-    n_frags_original = df_frag_long[
-        df_frag_long["original_or_reenacted"] == "OG"
-    ].shape[0]
-    file_output.write(f"count (original) = {n_frags_original}\n")
-
-    # Print number of re-enacted long fragments.
-    n_frags_reenacted = df_frag_long[
-        df_frag_long["original_or_reenacted"] == "RE"
-    ].shape[0]
-    file_output.write(f"count (re-enacted) = {n_frags_reenacted}\n")
+    file_output.write(f"count (original) = {stats_frags['count_original']}\n")
+    file_output.write(f"count (re-enacted) = {stats_frags['count_reenacted']}\n")
 
+    # Print total, mean, minimum, and maximum duration of fragments.
     file_output.write("duration\n")
+    for stat_name, duration in stats_frags["duration"].items():
+        file_output.write(f"\t{stat_name} = {duration}\n")
 
-    # Print total duration of long fragments.
-    duration_total = df_frag_long["duration"].sum()
-    file_output.write(f"\ttotal = {duration_total}\n")
-
-    # Print mean duration of long fragments.
-    duration_mean = df_frag_long["duration"].mean()
-    file_output.write(f"\tmean = {duration_mean}\n")
+    if stats_audio is not None:
+        print_audio(stats_audio, file_output)
 
-    # Print minimum duration of long fragments.
-    duration_min = df_frag_long["duration"].min()
-    file_output.write(f"\tminimum = {duration_min}\n")
 
-    # Print maximum duration of long fragments.
-    duration_max = df_frag_long["duration"].max()
-    file_output.write(f"\tmaximum = {duration_max}\n")
+def print_audio(stats_audio: dict, file_output: TextIO) -> None:
+    # Print total duration of audio files, if any were found.
+    if stats_audio["count_files"] == 0:
+        return
+    file_output.write(f"audio files count = {stats_audio['count_files']}\n")
+    if stats_audio["count_missing"]:
+        file_output.write(f"\tmissing = {stats_audio['count_missing']}\n")
+    file_output.write(f"\tduration total = {stats_audio['duration_total']}\n")
 
 
 if __name__ == "__main__":
@@ -1,11 +1,21 @@
-import subprocess
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
 from pathlib import Path
+from typing import Optional
 
 import pandas as pd
-import sox
+import TTS
 from tqdm import tqdm
-from tqdm.contrib.concurrent import process_map
+from TTS.utils.manage import ModelManager
+from TTS.utils.synthesizer import Synthesizer
 from utils.dirs import make_dirs_in_path_if_not_exist
+from utils.qc import audio_stats
+from utils.workers import limit_threads, threads_per_worker
 
 
 class SynthesisException(Exception):
@@ -30,13 +40,21 @@ def main():
     print(f"Done. Wrote to: {input_metadata_path}")
 
 
-def synthesize_fragments(df_frags, dir_output: Path) -> pd.DataFrame:
+def synthesize_fragments(
+    df_frags, dir_output: Path, n_workers: int = 4
+) -> pd.DataFrame:
 
     make_dirs_in_path_if_not_exist(dir_output)
 
     if "text" not in df_frags.columns:
         raise ("Metadata does not contain the column 'text' with transcriptions.")
 
+    # Apply the outcomes recorded by previous, possibly interrupted, runs. Fragments
+    # with successful synthesis are not synthesized or probed again.
+    path_journal = dir_output.joinpath("journal.jsonl")
+    df_journal = read_journal(path_journal)
+    df_frags = apply_journal(df_frags, df_journal)
+
     bool_has_text = df_frags["text"].notna()
 
     idx_has_text = df_frags[bool_has_text].index
@@ -69,54 +87,305 @@ def synthesize_fragments(df_frags, dir_output: Path) -> pd.DataFrame:
         idx_to_process
     ].apply(lambda frag: get_path_synth(frag.audio_path, dir_output), axis=1)
 
-    # Synthesize fragments.
-    print(f"{idx_to_process.size} fragments to attempt synthesis.")
-    process_map(
-        text_to_speech,
-        df_frags.loc[idx_to_process, "text"],
-        df_frags.loc[idx_to_process, "lang_code"],
-        df_frags.loc[idx_to_process, "audio_path_synthesis"],
-        total=df_frags.loc[idx_to_process].shape[0],
-        chunksize=1,
+    # Many fragments share the same text (e.g. "yeah", "okay"), so each distinct text,
+    # language, and model is synthesized once into a content-addressed cache, and the
+    # cached audio is linked to each fragment's synthesis path.
+    dir_cache = dir_output.joinpath("cache")
+    make_dirs_in_path_if_not_exist(dir_cache)
+    series_path_cache = pd.Series(
+        [
+            str(get_path_cache(text, lang_code, dir_cache))
+            for text, lang_code in zip(
+                df_frags.loc[idx_to_process, "text"],
+                df_frags.loc[idx_to_process, "lang_code"],
+            )
+        ],
+        index=idx_to_process,
+        dtype=object,
     )
+    bool_cache_first = ~series_path_cache.duplicated()
+    bool_cache_present = series_path_cache.apply(lambda path: Path(path).is_file())
+    idx_to_synthesize = idx_to_process[bool_cache_first & ~bool_cache_present]
+    idx_cached = idx_to_process[bool_cache_first & bool_cache_present]
+
+    # Durations of cached audios recorded by previous runs, so they are not probed.
+    if df_journal.empty:
+        cache_durations = {}
+    else:
+        df_journal_durations = df_journal.dropna(subset=["duration_synthesis"])
+        cache_durations = dict(
+            zip(
+                df_journal_durations["path_cache"],
+                df_journal_durations["duration_synthesis"],
+            )
+        )
 
-    # If the output synthesis file exists, the synthesis succeeded.
-    bool_synth_success = df_frags.loc[idx_to_process, "audio_path_synthesis"].apply(
-        lambda path: Path(path).is_file()
+    # Group the fragments by their cached audio, to link and journal them together.
+    frag_ids_by_path_cache = {
+        path_cache: series.index.to_list()
+        for path_cache, series in series_path_cache.groupby(series_path_cache)
+    }
+
+    def journal_fragments(
+        file_journal, path_cache: str, duration, failure, elapsed: float
+    ) -> None:
+        # Link the cached audio to each fragment sharing it and append their outcomes
+        # to the journal.
+        for frag_id in frag_ids_by_path_cache[path_cache]:
+            path_synth = df_frags.at[frag_id, "audio_path_synthesis"]
+            if failure is None:
+                link_or_copy(Path(path_cache), Path(path_synth))
+            write_journal_record(
+                file_journal,
+                frag_id,
+                path_synth,
+                path_cache,
+                duration,
+                failure,
+                elapsed,
+            )
+
+    # Synthesize fragments. Each worker process loads the models once, then synthesizes
+    # a stream of texts. Each outcome is journaled as soon as it completes.
+    print(
+        f"{idx_to_process.size} fragments to attempt synthesis, "
+        f"{idx_to_synthesize.size} distinct texts not in the cache."
+    )
+    with open(path_journal, "a") as file_journal, ProcessPoolExecutor(
+        n_workers,
+        initializer=_init_worker,
+        initargs=(threads_per_worker(n_workers),),
+    ) as executor:
+        for path_cache in series_path_cache[idx_cached]:
+            duration = cache_durations.get(path_cache)
+            if duration is None:
+                duration = audio_stats(path_cache)["duration"]
+            journal_fragments(file_journal, path_cache, duration, None, 0.0)
+
+        futures = {
+            executor.submit(text_to_speech, text, lang_code, path_cache): path_cache
+            for text, lang_code, path_cache in zip(
+                df_frags.loc[idx_to_synthesize, "text"],
+                df_frags.loc[idx_to_synthesize, "lang_code"],
+                series_path_cache[idx_to_synthesize],
+            )
+        }
+        for future in tqdm(as_completed(futures), total=len(futures)):
+            duration, failure, elapsed = future.result()
+            journal_fragments(file_journal, futures[future], duration, failure, elapsed)
+
+    n_cache_hits = idx_to_process.size - idx_to_synthesize.size
+    print(
+        f"Synthesis cache hits: {n_cache_hits} of {idx_to_process.size} fragments "
+        f"({n_cache_hits / max(idx_to_process.size, 1) * 100:.1f}%)."
     )
-    idx_successful = idx_to_process[bool_synth_success]
-    idx_failed = idx_to_process[~bool_synth_success]
 
-    # If the synthesis failed, replace synthesis audio path with NaN.
-    if not idx_failed.empty:
+    # Update the metadata from the journal.
+    df_journal = read_journal(path_journal)
+    df_frags = apply_journal(df_frags, df_journal)
+
+    df_journal_run = df_journal[df_journal["id"].isin(idx_to_process)]
+    for failure, df_journal_failure in df_journal_run.groupby("failure"):
         print(
-            f"{idx_failed.size} fragments had failed synthesis: {idx_failed.to_list()}"
+            f"{df_journal_failure.shape[0]} fragments failed synthesis ({failure}): "
+            f"{df_journal_failure['id'].to_list()}"
         )
-        df_frags.loc[idx_failed, "audio_path_synthesis"] = None
 
-    def get_duration(path_audio: str):
-        duration_seconds = sox.file_info.duration(path_audio)
-        duration_timedelta = pd.to_timedelta(duration_seconds, "s")
-        return duration_timedelta
-
-    # Store duration of the synthesized audio as Timedelta for successful fragments.
-    df_frags.loc[idx_successful, "duration_synthesis"] = df_frags.loc[
-        idx_successful, "audio_path_synthesis"
-    ].apply(get_duration)
-
-    # If the synthesis has bad duration, replace path with NaN.
-    duration_min = pd.Timedelta(0.3, "seconds")
-    duration_max = pd.Timedelta(30, "seconds")
-    bool_bad_duration = df_frags.loc[idx_successful, "duration_synthesis"].apply(
-        lambda duration: (duration < duration_min) | (duration > duration_max)
+    df_frags = qc_synthesis(df_frags, dir_output.joinpath("journal-qc.jsonl"))
+
+    return df_frags
+
+
+def qc_synthesis(
+    df_frags: pd.DataFrame,
+    path_journal_qc: Path,
+    n_threads: int = 16,
+    duration_min: pd.Timedelta = pd.Timedelta(0.3, "seconds"),
+    duration_max: pd.Timedelta = pd.Timedelta(30, "seconds"),
+    silence_ratio_max: float = 0.8,
+    clipping_rate_max: float = 0.01,
+    rms_db_min: float = -40,
+) -> pd.DataFrame:
+    # Check the synthesized audios. Each audio is read once (see utils/qc.py), in a
+    # thread pool, and its stats are stored in the columns "duration_synthesis",
+    # "silence_ratio_synthesis", "clipping_rate_synthesis", and "rms_db_synthesis".
+    # Fragments with stats outside the thresholds, or whose audio is missing, have their
+    # synthesis path replaced with NaN and the reason stored in "failure_synthesis".
+    # The stats are journaled as they complete, and audios with journaled stats and an
+    # unchanged modification time are not read again.
+    idx_synth = df_frags[df_frags["audio_path_synthesis"].notna()].index
+    if idx_synth.empty:
+        return df_frags
+
+    paths_synth = df_frags.loc[idx_synth, "audio_path_synthesis"]
+    qc_records = read_qc_journal(path_journal_qc)
+    mtimes = {path: get_mtime_ns(path) for path in paths_synth.unique()}
+    paths_to_read = [
+        path
+        for path, mtime_ns in mtimes.items()
+        if mtime_ns is not None
+        and (path not in qc_records or qc_records[path]["mtime_ns"] != mtime_ns)
+    ]
+    print(
+        f"QC of {len(mtimes)} synthesized audios: {len(paths_to_read)} to read, "
+        f"{len(mtimes) - len(paths_to_read)} journaled or missing."
+    )
+
+    with open(path_journal_qc, "a") as file_journal_qc, ThreadPoolExecutor(
+        n_threads
+    ) as executor:
+        for path, stats in zip(
+            paths_to_read, executor.map(read_audio_stats, paths_to_read)
+        ):
+            if stats is None:
+                mtimes[path] = None
+                continue
+            qc_records[path] = {
+                "audio_path_synthesis": path,
+                "mtime_ns": mtimes[path],
+                **stats,
+            }
+            file_journal_qc.write(json.dumps(qc_records[path]) + "\n")
+            file_journal_qc.flush()
+
+    bool_missing = paths_synth.map(mtimes).isna()
+    df_stats = pd.DataFrame(
+        [qc_records[path] if mtimes[path] is not None else {} for path in paths_synth],
+        index=idx_synth,
+        columns=QC_STAT_NAMES,
     )
-    idx_bad_duration = idx_successful[bool_bad_duration]
-    if not idx_bad_duration.empty:
+    df_stats["duration"] = pd.to_timedelta(df_stats["duration"], "s")
+
+    df_frags.loc[idx_synth, "duration_synthesis"] = df_stats["duration"]
+    for stat_name in ["silence_ratio", "clipping_rate", "rms_db"]:
+        df_frags.loc[idx_synth, f"{stat_name}_synthesis"] = df_stats[stat_name]
+
+    # Store the first failed check of each fragment.
+    checks = {
+        "missing audio": bool_missing,
+        "bad duration": (df_stats["duration"] < duration_min)
+        | (df_stats["duration"] > duration_max),
+        "mostly silence": df_stats["silence_ratio"] > silence_ratio_max,
+        "clipping": df_stats["clipping_rate"] > clipping_rate_max,
+        "low energy": df_stats["rms_db"] < rms_db_min,
+    }
+    for failure, bool_failed in checks.items():
+        idx_failed = idx_synth[
+            bool_failed.to_numpy()
+            & df_frags.loc[idx_synth, "audio_path_synthesis"].notna().to_numpy()
+        ]
+        if idx_failed.empty:
+            continue
         print(
-            f"{idx_bad_duration.size} fragments had bad duration: {idx_bad_duration.to_list()}"
+            f"{idx_failed.size} fragments failed QC ({failure}): {idx_failed.to_list()}"
         )
-        df_frags.loc[idx_bad_duration, "audio_path_synthesis"] = None
+        df_frags.loc[idx_failed, "audio_path_synthesis"] = None
+        df_frags.loc[idx_failed, "failure_synthesis"] = failure
+
+    return df_frags
+
 
+QC_STAT_NAMES = ["duration", "silence_ratio", "clipping_rate", "rms_db"]
+
+
+def get_mtime_ns(path: str) -> Optional[int]:
+    # Return the modification time of a file in nanoseconds, or None if it is missing.
+    try:
+        return os.stat(path).st_mtime_ns
+    except FileNotFoundError:
+        return None
+
+
+def read_audio_stats(path: str) -> Optional[dict]:
+    # Return the QC stats of an audio (see utils/qc.py), or None if it is missing, so a
+    # missing audio fails its fragment instead of the whole QC.
+    try:
+        return audio_stats(path)
+    except FileNotFoundError:
+        return None
+
+
+def read_qc_journal(path_journal_qc: Path) -> dict:
+    # Read the QC journal into a dict from synthesis audio path to its last record, with
+    # the keys "audio_path_synthesis", "mtime_ns", and QC_STAT_NAMES. A partial last
+    # line from a crash is ignored.
+    qc_records = {}
+    if path_journal_qc.is_file():
+        with open(path_journal_qc) as file_journal_qc:
+            for line in file_journal_qc:
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    continue
+                qc_records[record["audio_path_synthesis"]] = record
+    return qc_records
+
+
+JOURNAL_COLUMNS = [
+    "id",
+    "audio_path_synthesis",
+    "path_cache",
+    "duration_synthesis",
+    "failure",
+    "elapsed",
+]
+
+
+def write_journal_record(
+    file_journal,
+    frag_id: str,
+    path_synth: str,
+    path_cache: str,
+    duration,
+    failure,
+    elapsed: float,
+) -> None:
+    # Append the synthesis outcome of a fragment to the journal, one JSON object per
+    # line, and flush so the record survives a crash. `duration` and `elapsed` are in
+    # seconds; `failure` is None if the synthesis succeeded, otherwise the reason.
+    record = dict(
+        zip(
+            JOURNAL_COLUMNS,
+            [frag_id, path_synth, path_cache, duration, failure, elapsed],
+        )
+    )
+    file_journal.write(json.dumps(record) + "\n")
+    file_journal.flush()
+
+
+def read_journal(path_journal: Path) -> pd.DataFrame:
+    # Read the synthesis journal into a DataFrame with the columns in JOURNAL_COLUMNS.
+    # A fragment can have several records, e.g. a failure then a success; the last one
+    # is its current outcome. A partial last line from a crash is ignored.
+    records = []
+    if path_journal.is_file():
+        with open(path_journal) as file_journal:
+            for line in file_journal:
+                try:
+                    records.append(json.loads(line))
+                except json.JSONDecodeError:
+                    continue
+    df_journal = pd.DataFrame(records, columns=JOURNAL_COLUMNS)
+    df_journal = df_journal.drop_duplicates(subset="id", keep="last")
+    return df_journal
+
+
+def apply_journal(df_frags: pd.DataFrame, df_journal: pd.DataFrame) -> pd.DataFrame:
+    # Set the columns "audio_path_synthesis", "duration_synthesis" (Timedelta), and
+    # "failure_synthesis" of the fragments in the journal. Failed fragments have no
+    # synthesis path, so they are attempted again on the next run.
+    df_journal = df_journal[df_journal["id"].isin(df_frags.index)].set_index("id")
+    if df_journal.empty:
+        return df_frags
+
+    bool_failed = df_journal["failure"].notna()
+    df_frags.loc[df_journal.index, "audio_path_synthesis"] = df_journal[
+        "audio_path_synthesis"
+    ].where(~bool_failed, None)
+    df_frags.loc[df_journal.index, "duration_synthesis"] = pd.to_timedelta(
+        df_journal["duration_synthesis"], "s"
+    )
+    df_frags.loc[df_journal.index, "failure_synthesis"] = df_journal["failure"]
     return df_frags
 
 
@@ -124,42 +393,111 @@ class CoquiException(Exception):
     pass
 
 
-def text_to_speech(text: str, lang_code: str, path_output_str: str):
+lang_code_to_model_name = {
+    # The available models are listed by the command: tts --list_models
+    "EN": "tts_models/en/ljspeech/tacotron2-DDC",
+    "ES": "tts_models/es/mai/tacotron2-DDC",
+}
 
-    # Coqui TTS functions. Coqui TTS has a Python API with limited support for Apple
-    # silicon. Instead, this script uses the command line. To install, see docs:
+# The synthesizers of a worker process, one per language code, loaded once by
+# _init_worker.
+_worker_synthesizers = {}
+
+
+def load_synthesizer(model_name: str) -> Synthesizer:
+    # Load a Coqui TTS model and its default vocoder, downloading them if needed. This
+    # mirrors what the `tts` command does on every call. See docs:
     # https://github.com/coqui-ai/TTS
+    path_models_file = Path(TTS.__file__).parent.joinpath(".models.json")
+    manager = ModelManager(path_models_file, progress_bar=False)
+    model_path, config_path, model_item = manager.download_model(model_name)
+    vocoder_path, vocoder_config_path, _ = manager.download_model(
+        model_item["default_vocoder"]
+    )
+    return Synthesizer(
+        tts_checkpoint=model_path,
+        tts_config_path=config_path,
+        vocoder_checkpoint=vocoder_path,
+        vocoder_config=vocoder_config_path,
+        use_cuda=False,
+    )
 
-    # Ignore if output exists.
-    path_output = Path(path_output_str)
-    if path_output.exists():
+
+def normalize_text(text: str) -> str:
+    # Normalize a text for the synthesis cache key: lowercase, collapse whitespace. The
+    # Coqui TTS text cleaners also lowercase, so this does not change the synthesis.
+    return " ".join(text.lower().split())
+
+
+def get_path_cache(text: str, lang_code: str, dir_cache: Path) -> Path:
+    # Return the path of the cached synthesis audio of a text, keyed by the normalized
+    # text, language code, and model name.
+    if lang_code not in lang_code_to_model_name:
+        raise CoquiException("Unexpected language code.")
+    model_name = lang_code_to_model_name[lang_code]
+    key = f"{model_name}\n{lang_code}\n{normalize_text(text)}"
+    digest = hashlib.sha1(key.encode("utf-8")).hexdigest()
+    return dir_cache.joinpath(f"{digest}.wav")
+
+
+def link_or_copy(path_source: Path, path_output: Path) -> None:
+    # Hard link a file, or copy it if hard links are not supported (e.g. across file
+    # systems). Ignore if the source does not exist (failed synthesis) or the output
+    # exists.
+    if not path_source.is_file() or path_output.exists():
         return
+    try:
+        os.link(path_source, path_output)
+    except OSError:
+        shutil.copy(path_source, path_output)
+
+
+def _init_worker(n_threads: int) -> None:
+    limit_threads(n_threads)
+    for lang_code, model_name in lang_code_to_model_name.items():
+        _worker_synthesizers[lang_code] = load_synthesizer(model_name)
+
+
+def text_to_speech(
+    text: str, lang_code: str, path_output_str: str
+) -> tuple[Optional[float], Optional[str], float]:
+    # Synthesize a text to a WAV file with the worker's synthesizer for the language.
+    # Returns the duration of the synthesized audio in seconds (None if it failed), the
+    # reason for failure (None if it succeeded), and the seconds elapsed.
+    time_start = time.perf_counter()
+    path_output = Path(path_output_str)
 
     # TODO Move this check to synthesis script.
     if pd.isna(text):
-        return
+        return None, "missing text", time.perf_counter() - time_start
 
-    if lang_code == "EN":
-        model_name = "tts_models/en/ljspeech/tacotron2-DDC"
-    elif lang_code == "ES":
-        model_name = "tts_models/es/mai/tacotron2-DDC"
-    else:
+    if lang_code not in _worker_synthesizers:
         raise CoquiException("Unexpected language code.")
-
-    # Run the Coqui TTS command.
-    # TODO Check return code of return completed process.
-    subprocess.run(
-        [
-            "tts",
-            "--text",
-            text,
-            "--model_name",
-            model_name,
-            "--out_path",
-            str(path_output),
-        ],
-        capture_output=True,
+    synthesizer = _worker_synthesizers[lang_code]
+
+    # Any exception from one text (e.g. from the tokenizer) is returned as its failure
+    # reason, so it is journaled without aborting the other texts.
+    try:
+        wav = synthesizer.tts(text)
+    except Exception as exception:
+        return None, f"exception: {exception!r}", time.perf_counter() - time_start
+
+    # Write to a temporary file in the cache directory, then rename it onto the cache
+    # path, so a crash mid-write never leaves a truncated audio that a later run would
+    # count as cached. The outcome is journaled only after this returns.
+    file_tmp, path_tmp = tempfile.mkstemp(
+        dir=path_output.parent, prefix=f"{path_output.stem}-", suffix=".tmp"
     )
+    os.close(file_tmp)
+    try:
+        synthesizer.save_wav(wav, path_tmp)
+        os.replace(path_tmp, path_output)
+    except BaseException:
+        Path(path_tmp).unlink(missing_ok=True)
+        raise
+
+    duration = len(wav) / synthesizer.output_sample_rate
+    return duration, None, time.perf_counter() - time_start
 
 
 if __name__ == "__main__":
@@ -0,0 +1,7 @@
+# Make the scripts and utils of DRAL-corpus importable from the tests, as when the
+# scripts are run from DRAL-corpus.
+
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent.parent.resolve()))
@@ -0,0 +1,38 @@
+import json
+
+import numpy as np
+import pandas as pd
+from export_shards import export_shards, read_member
+from scipy.io import wavfile
+
+
+def _reject_constant(constant: str):
+    raise ValueError(f"Invalid JSON constant: {constant}")
+
+
+def test_export_shards_missing_value_is_null(tmp_path):
+    dir_audio = tmp_path / "audio"
+    dir_audio.mkdir()
+    dir_output = tmp_path / "shards"
+    dir_output.mkdir()
+    df_frags = pd.DataFrame(
+        {
+            "id": ["EN_001_1", "EN_001_2"],
+            "text": ["hello", np.nan],
+            "duration": [0.5, np.nan],
+        }
+    )
+    for frag_id in df_frags["id"]:
+        wavfile.write(dir_audio / f"{frag_id}.wav", 16000, np.zeros(8000, np.int16))
+
+    df_index = export_shards(
+        df_frags, dir_audio, dir_output, "fragments-short", n_workers=1
+    )
+
+    row = df_index.set_index("id").loc["EN_001_2"]
+    metadata = read_member(
+        dir_output / row["shard"], row["offset_json"], row["size_json"]
+    )
+    # A strict parse, which rejects the NaN, Infinity, and -Infinity tokens.
+    record = json.loads(metadata, parse_constant=_reject_constant)
+    assert record == {"id": "EN_001_2", "text": None, "duration": None}
@@ -0,0 +1,28 @@
+import numpy as np
+from utils.vad import find_speech_regions
+
+SAMPLE_RATE = 16000
+
+
+def test_find_speech_regions_silence():
+    regions = find_speech_regions(np.zeros(SAMPLE_RATE), SAMPLE_RATE)
+    assert regions.shape == (0, 2)
+
+
+def test_find_speech_regions_noise_below_floor():
+    rng = np.random.default_rng(0)
+    audio = 1e-5 * rng.standard_normal(SAMPLE_RATE)
+    regions = find_speech_regions(audio, SAMPLE_RATE)
+    assert regions.shape == (0, 2)
+
+
+def test_find_speech_regions_tone_in_silence():
+    # One second of tone between two seconds of silence, at each end.
+    audio = np.zeros(5 * SAMPLE_RATE)
+    t = np.arange(SAMPLE_RATE) / SAMPLE_RATE
+    audio[2 * SAMPLE_RATE : 3 * SAMPLE_RATE] = 0.5 * np.sin(2 * np.pi * 200 * t)
+    regions = find_speech_regions(audio, SAMPLE_RATE, padding_s=0)
+    assert regions.shape == (1, 2)
+    start, end = regions[0]
+    assert abs(start - 2 * SAMPLE_RATE) < SAMPLE_RATE * 0.03
+    assert abs(end - 3 * SAMPLE_RATE) < SAMPLE_RATE * 0.03
@@ -0,0 +1,90 @@
+# Approximate nearest neighbor index over the text embeddings of one language's
+# fragments, built by compute_similar_texts.py. The index is persisted, so similar texts
+# can be looked up in milliseconds without a pairwise pass over all fragments. Example:
+#
+#   index = TextIndex.load("release/text-index-EN.pkl")
+#   index.similar_to_fragment("EN_001_2", k=4)
+#   index.similar_to_text("yeah, I think so", k=4)
+
+import pickle
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import spacy
+from pynndescent import NNDescent
+
+RANDOM_STATE_VAL = 42
+
+
+class TextIndex:
+    def __init__(
+        self,
+        frag_ids: list[str],
+        texts: list[str],
+        embeddings: np.ndarray,
+        pipeline_name: str,
+        n_neighbors: int = 30,
+    ) -> None:
+        # `embeddings` are the spaCy document vectors of `texts`, computed with the
+        # pipeline named `pipeline_name` (e.g. "en_core_web_sm"), which is also used to
+        # embed query texts.
+        self.frag_ids = np.asarray(frag_ids)
+        self.texts = np.asarray(texts)
+        self.embeddings = np.asarray(embeddings, dtype=np.float32)
+        self.pipeline_name = pipeline_name
+        self._frag_id_to_row = {frag_id: row for row, frag_id in enumerate(frag_ids)}
+        self._nlp = None
+
+        self.index = NNDescent(
+            self.embeddings,
+            metric="cosine",
+            n_neighbors=min(n_neighbors, len(frag_ids) - 1),
+            random_state=RANDOM_STATE_VAL,
+        )
+        # Build the search graph now, so it is persisted with the index.
+        self.index.prepare()
+
+    def __getstate__(self) -> dict:
+        # The spaCy pipeline is loaded on demand, not pickled.
+        state = self.__dict__.copy()
+        state["_nlp"] = None
+        return state
+
+    def save(self, path: Path) -> None:
+        with open(path, "wb") as file:
+            pickle.dump(self, file)
+
+    @staticmethod
+    def load(path: Path) -> "TextIndex":
+        with open(path, "rb") as file:
+            return pickle.load(file)
+
+    def similar_to_fragment(self, frag_id: str, k: int = 4) -> pd.DataFrame:
+        # Return the `k` fragments with the most similar texts to a fragment's text,
+        # excluding the fragment itself.
+        row = self._frag_id_to_row[frag_id]
+        df_similar = self._query(self.embeddings[row : row + 1], k + 1)
+        df_similar = df_similar[df_similar["id"] != frag_id]
+        return df_similar.head(k).reset_index(drop=True)
+
+    def similar_to_text(self, text: str, k: int = 4) -> pd.DataFrame:
+        # Return the `k` fragments with the most similar texts to an arbitrary text.
+        if self._nlp is None:
+            self._nlp = spacy.load(self.pipeline_name)
+        with self._nlp.select_pipes(enable=["tok2vec"]):
+            vector = self._nlp(text).vector
+        return self._query(vector[np.newaxis, :], k)
+
+    def _query(self, query: np.ndarray, k: int) -> pd.DataFrame:
+        # Return a DataFrame with the columns "id", "text", and "similarity" (cosine
+        # similarity) of the nearest neighbors of a single query vector, most similar
+        # first.
+        rows, distances = self.index.query(query.astype(np.float32), k=k)
+        return pd.DataFrame(
+            {
+                "id": self.frag_ids[rows[0]],
+                "text": self.texts[rows[0]],
+                "similarity": 1 - distances[0],
+            }
+        )
@@ -2,8 +2,11 @@
 #
 # The inputs are the single-speaker concatenated conversation audios
 # (fragments-short-contatenated/*.wav) and metadata CSV file
-# (`fragments-short-matlab.csv`). The output is an augmented metadata CSV file
-# (`fragments-short-matlab-transcribed.csv`), adding the columns: text, segments.
+# (`fragments-short-matlab.csv`). The outputs are an augmented metadata CSV file
+# (`fragments-short-matlab-transcribed.csv`), adding the columns: text, text1, text2,
+# and a long-format table of word timestamps
+# (`fragments-short-matlab-transcribed-words.parquet`), with one row per transcribed
+# word. See read_words() in ../modeling/data.py to load it.
 #
 # To improve the quality of transcriptions, each single-speaker conversation audio is
 # transcribed, then the transcription segments are matched to the individual fragments.
@@ -12,11 +15,17 @@
 # (https://github.com/ggerganov/whisper.cpp), which is no longer needed for Apple
 # silicon devices.
 
+import argparse
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
 
+import numpy as np
 import pandas as pd
+import torch
 import whisper
 from tqdm import tqdm  # For progress bars.
+from utils.vad import find_speech_regions, split_regions
+from utils.workers import limit_threads, threads_per_worker
 
 
 class WhisperException(Exception):
@@ -33,6 +42,26 @@ whisper_lang_to_model_name = {
 
 
 def main():
+    parser = argparse.ArgumentParser(
+        description="Transcribe DRAL short fragments with OpenAI Whisper models.",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+    )
+    parser.add_argument(
+        "--quantize",
+        help="Run the models on CPU with dynamic int8 quantization of their linear "
+        "layers. See benchmark_transcription.py for the speed and accuracy trade-off.",
+        action=argparse.BooleanOptionalAction,
+        default=False,
+    )
+    parser.add_argument(
+        "--n_workers",
+        help="Number of worker processes that transcribe chunks of each conversation "
+        "audio in parallel (first method only). Each worker loads its own model.",
+        type=int,
+        default=1,
+    )
+    args = parser.parse_args()
+
     tqdm.pandas()
 
     dir_this_script = Path(__file__).parent
@@ -55,28 +84,28 @@ def main():
     df_frags_es = df_frags[df_frags["lang_code"] == "ES"]
 
     # Transcribe using the first method.
-    df_frags_en_transcribed = transcribe_frags_full_with_segments(
-        df_frags_en, dir_release, "en"
+    df_frags_en_transcribed, df_words_en1 = transcribe_frags_full_with_segments(
+        df_frags_en, dir_release, "en", quantize=args.quantize, n_workers=args.n_workers
     )
-    df_frags_es_transcribed = transcribe_frags_full_with_segments(
-        df_frags_es, dir_release, "es"
+    df_frags_es_transcribed, df_words_es1 = transcribe_frags_full_with_segments(
+        df_frags_es, dir_release, "es", quantize=args.quantize, n_workers=args.n_workers
     )
 
     # Transcribe using the second method.
-    df_frags_en_transcribed = transcribe_frags_by_utterance(
-        df_frags_en, dir_release, "en"
+    df_frags_en_transcribed, df_words_en2 = transcribe_frags_by_utterance(
+        df_frags_en_transcribed, dir_release, "en", quantize=args.quantize
     )
-    df_frags_es_transcribed = transcribe_frags_by_utterance(
-        df_frags_es, dir_release, "es"
+    df_frags_es_transcribed, df_words_es2 = transcribe_frags_by_utterance(
+        df_frags_es_transcribed, dir_release, "es", quantize=args.quantize
     )
 
     # Combine the augmented DataFrames, sort by fragment ID.
     df_frags_transcribed = pd.concat(
         [df_frags_en_transcribed, df_frags_es_transcribed]
     ).sort_index()
+    df_words = pd.concat([df_words_en1, df_words_es1, df_words_en2, df_words_es2])
 
     # Create column "text" that copies "text1" if available, otherwise "text2".
-    df_frags_transcribed = df_frags
     df_frags_transcribed["text"] = df_frags_transcribed["text1"].fillna(
         df_frags_transcribed["text2"]
     )
@@ -87,42 +116,75 @@ def main():
     )
     df_frags_transcribed.to_csv(path_out_metadata)
 
+    # Write the word timestamps next to the augmented metadata.
+    path_out_words = path_out_metadata.parent.joinpath(
+        f"{path_out_metadata.stem}-words.parquet"
+    )
+    write_words(df_words, path_out_words)
+
 
 def transcribe_frags_full_with_segments(
-    df_frags: pd.DataFrame, dir_release: Path, whisper_lang_code: str
-) -> pd.DataFrame:
+    df_frags: pd.DataFrame,
+    dir_release: Path,
+    whisper_lang_code: str,
+    skip_silence: bool = True,
+    quantize: bool = False,
+    n_workers: int = 1,
+) -> tuple[pd.DataFrame, pd.DataFrame]:
     # Method 1 of transcribing fragments: Transcribe the full conversation audio, then
     # match the transcription segments to the individual fragments. Returns a DataFrame
-    # with added columns "segments1" and "text1".
+    # with added column "text1", and a DataFrame of the fragments' words (see
+    # words_to_dataframe).
+    #
+    # If `skip_silence` is True, only the regions of the conversation audio with speech
+    # (see utils/vad.py) are transcribed, so Whisper does not spend 30-second windows on
+    # long low-energy regions. Word times are mapped back to conversation audio time.
+    #
+    # If `n_workers` is greater than 1, each conversation audio is split into
+    # overlapping chunks at low-energy points, and the chunks are transcribed in
+    # parallel. Each conversation is transcribed with condition_on_previous_text=False,
+    # so the chunks are independent. A word in an overlap is kept from the chunk that
+    # owns its midpoint (see utils/vad.py).
 
     model_name = whisper_lang_to_model_name[whisper_lang_code]
 
-    model = whisper.load_model(model_name, in_memory=True)
+    if n_workers > 1:
+        executor = ProcessPoolExecutor(
+            n_workers,
+            initializer=_init_worker,
+            initargs=(model_name, quantize, threads_per_worker(n_workers)),
+        )
+    else:
+        model = load_model(model_name, quantize)
+
+    word_rows = []
 
     concat_audio_paths = pd.unique(df_frags["concat_audio_path"])
     for path_concat_audio in tqdm(concat_audio_paths, total=len(concat_audio_paths)):
         df_frags_conv = df_frags[df_frags["concat_audio_path"] == path_concat_audio]
 
+        # Decode the conversation audio once, as 16 kHz mono float32.
         path_audio_full = dir_release.joinpath(path_concat_audio)
+        audio_full = whisper.load_audio(str(path_audio_full))
+
+        if skip_silence:
+            regions = find_speech_regions(audio_full, whisper.audio.SAMPLE_RATE)
+        else:
+            regions = np.array([[0, audio_full.shape[0]]])
 
         try:
-            result = model.transcribe(
-                str(path_audio_full),
-                language=whisper_lang_code,
-                word_timestamps=True,
-                verbose=True,
-                condition_on_previous_text=False,  # Each conversation is transcribed independently.
-                fp16=False,  # Apple silicon does not support fp16.
-            )
+            if n_workers > 1:
+                conversation_words = transcribe_chunks_parallel(
+                    executor, audio_full, regions, whisper_lang_code
+                )
+            else:
+                conversation_words = transcribe_regions(
+                    model, audio_full, regions, whisper_lang_code
+                )
         except WhisperException:
             print("Exception when transcribing fragment (TODO Handle)")
             continue
 
-        segments = result["segments"]
-
-        # Collect all "words" into a flat list.
-        conversation_words = [word for segment in segments for word in segment["words"]]
-
         # Convert the "start" and "end" values to Timedelta.
         for word in conversation_words:
             word["start"] = pd.to_timedelta(word["start"], unit="s")
@@ -140,26 +202,49 @@ def transcribe_frags_full_with_segments(
                 if row["time_start_rel"] <= word["start"] <= row["time_end_rel"]
             ]
 
-            # Save the list words as a string.
-            df_frags.loc[idx, "segments1"] = str(words)
+            # Store the words with times relative to the start of the fragment.
+            for word_idx, word in enumerate(words):
+                word_rows.append(
+                    (
+                        idx,
+                        1,
+                        word_idx,
+                        word["word"],
+                        (word["start"] - row["time_start_rel"]).total_seconds(),
+                        (word["end"] - row["time_start_rel"]).total_seconds(),
+                        word["probability"],
+                    )
+                )
 
             # Join the words into a string and insert.
             text = " ".join([word["word"] for word in words])
             df_frags.loc[idx, "text1"] = text
 
-    return df_frags
+    if n_workers > 1:
+        executor.shutdown()
+
+    return df_frags, words_to_dataframe(word_rows)
 
 
 def transcribe_frags_by_utterance(
-    df_frags: pd.DataFrame, dir_release: Path, whisper_lang_code: str
-) -> pd.DataFrame:
+    df_frags: pd.DataFrame,
+    dir_release: Path,
+    whisper_lang_code: str,
+    quantize: bool = False,
+) -> tuple[pd.DataFrame, pd.DataFrame]:
     # Method 2 of transcribing fragments: Transcribe each fragment independently. This
-    # method is *significantly* slower. Returns a DataFrame with added columns
-    # "segments2" and "text2".
+    # method is *significantly* slower. Returns a DataFrame with added column "text2",
+    # and a DataFrame of the fragments' words (see words_to_dataframe).
+    #
+    # Each single-speaker concatenated conversation audio is decoded once, and the
+    # fragments are passed to Whisper as slices of it, instead of passing a path per
+    # fragment (Whisper spawns ffmpeg to decode and resample every path it is given).
 
     model_name = whisper_lang_to_model_name[whisper_lang_code]
 
-    model = whisper.load_model(model_name, in_memory=True)
+    model = load_model(model_name, quantize)
+
+    word_rows = []
 
     concat_audio_paths = pd.unique(df_frags["concat_audio_path"])
     for path_concat_audio in tqdm(concat_audio_paths, total=len(concat_audio_paths)):
@@ -167,13 +252,19 @@ def transcribe_frags_by_utterance(
 
         df_frags_conv = df_frags_conv.sort_values(by="time_start_rel")
 
+        # Decode the conversation audio once, as 16 kHz mono float32.
+        path_audio_full = dir_release.joinpath(path_concat_audio)
+        audio_full = whisper.load_audio(str(path_audio_full))
+
         # Iterate over the rows of df_frags_conv.
         for idx, row in df_frags_conv.iterrows():
-            path_audio_full = dir_release.joinpath(row["audio_path"])
+            audio_frag = slice_audio(
+                audio_full, row["time_start_rel"], row["time_end_rel"]
+            )
 
             try:
                 result = model.transcribe(
-                    str(path_audio_full),
+                    audio_frag,
                     language=whisper_lang_code,
                     word_timestamps=True,
                     verbose=True,
@@ -184,11 +275,182 @@ def transcribe_frags_by_utterance(
                 print("Exception when transcribing fragment (TODO Handle)")
                 continue
 
-            # Insert the words that fall within the time range of the row.
-            df_frags.loc[idx, "segments2"] = str(result["segments"])
+            # The word times are already relative to the start of the fragment.
+            words = [
+                word for segment in result["segments"] for word in segment["words"]
+            ]
+            for word_idx, word in enumerate(words):
+                word_rows.append(
+                    (
+                        idx,
+                        2,
+                        word_idx,
+                        word["word"],
+                        word["start"],
+                        word["end"],
+                        word["probability"],
+                    )
+                )
+
             df_frags.loc[idx, "text2"] = result["text"]
 
-    return df_frags
+    return df_frags, words_to_dataframe(word_rows)
+
+
+WORDS_COLUMNS = [
+    "frag_id",
+    "method",
+    "word_idx",
+    "text",
+    "time_start",
+    "time_end",
+    "probability",
+]
+
+
+def words_to_dataframe(word_rows: list[tuple]) -> pd.DataFrame:
+    # Convert a list of word tuples into a long-format DataFrame with the columns in
+    # WORDS_COLUMNS. "method" is the transcription method (1 or 2) that produced the
+    # word, "word_idx" is the position of the word in its fragment, and "time_start"
+    # and "time_end" are in seconds relative to the start of the fragment. Appending to
+    # a list before converting to a DataFrame is faster than appending to a DataFrame.
+    df_words = pd.DataFrame(word_rows, columns=WORDS_COLUMNS)
+    df_words = df_words.astype(
+        {
+            "method": np.int8,
+            "word_idx": np.int32,
+            "time_start": np.float32,
+            "time_end": np.float32,
+            "probability": np.float32,
+        }
+    )
+    return df_words
+
+
+def write_words(df_words: pd.DataFrame, path_words: Path) -> None:
+    # Write the word timestamps to Parquet, sorted so that each fragment's words are
+    # stored contiguously.
+    df_words = df_words.sort_values(["frag_id", "method", "word_idx"])
+    df_words.to_parquet(path_words, index=False)
+
+
+def load_model(model_name: str, quantize: bool = False) -> whisper.Whisper:
+    # Load a Whisper model. If `quantize` is True, load it on CPU and apply dynamic int8
+    # quantization to its linear layers (weights are stored as int8, activations are
+    # quantized on the fly), which speeds up CPU inference.
+    if not quantize:
+        return whisper.load_model(model_name, in_memory=True)
+
+    model = whisper.load_model(model_name, device="cpu", in_memory=True)
+
+    # Whisper's linear layers subclass torch.nn.Linear only to cast their weights to
+    # the input dtype, and torch.quantization.quantize_dynamic() converts only exact
+    # torch.nn.Linear modules, so replace them with torch.nn.Linear first.
+    for module in list(model.modules()):
+        for name, child in module.named_children():
+            if (
+                isinstance(child, torch.nn.Linear)
+                and type(child) is not torch.nn.Linear
+            ):
+                linear = torch.nn.Linear(
+                    child.in_features, child.out_features, bias=child.bias is not None
+                )
+                linear.load_state_dict(child.state_dict())
+                setattr(module, name, linear)
+
+    model = torch.quantization.quantize_dynamic(
+        model, {torch.nn.Linear}, dtype=torch.qint8
+    )
+    return model
+
+
+def transcribe_regions(
+    model: whisper.Whisper,
+    audio: np.ndarray,
+    regions,
+    whisper_lang_code: str,
+) -> list[dict]:
+    # Transcribe regions of a decoded audio, given as (start sample, end sample) pairs.
+    # Returns the words of all regions in a flat list, with "start" and "end" in
+    # seconds relative to the start of the audio.
+    words = []
+    for sample_start, sample_end in regions:
+        result = model.transcribe(
+            audio[sample_start:sample_end],
+            language=whisper_lang_code,
+            word_timestamps=True,
+            verbose=True,
+            condition_on_previous_text=False,  # Each conversation is transcribed independently.
+            fp16=False,  # Apple silicon does not support fp16.
+        )
+        offset_seconds = sample_start / whisper.audio.SAMPLE_RATE
+        for segment in result["segments"]:
+            for word in segment["words"]:
+                word["start"] += offset_seconds
+                word["end"] += offset_seconds
+                words.append(word)
+    return words
+
+
+def transcribe_chunks_parallel(
+    executor: ProcessPoolExecutor,
+    audio: np.ndarray,
+    regions: np.ndarray,
+    whisper_lang_code: str,
+) -> list[dict]:
+    # Like transcribe_regions, but split the regions into overlapping chunks and
+    # transcribe the chunks with the executor's workers (see _init_worker). The words of
+    # each chunk are kept only if their midpoint is in the interval the chunk owns, so
+    # words in overlaps are not duplicated.
+    chunks, owned = split_regions(audio, whisper.audio.SAMPLE_RATE, regions)
+    futures = [
+        executor.submit(
+            _transcribe_chunk, audio[sample_start:sample_end], whisper_lang_code
+        )
+        for sample_start, sample_end in chunks
+    ]
+
+    words = []
+    for future, (sample_start, _), (owned_start, owned_end) in zip(
+        futures, chunks, owned
+    ):
+        offset_seconds = sample_start / whisper.audio.SAMPLE_RATE
+        owned_start_seconds = owned_start / whisper.audio.SAMPLE_RATE
+        owned_end_seconds = owned_end / whisper.audio.SAMPLE_RATE
+        for word in future.result():
+            word["start"] += offset_seconds
+            word["end"] += offset_seconds
+            word_midpoint = (word["start"] + word["end"]) / 2
+            if owned_start_seconds <= word_midpoint < owned_end_seconds:
+                words.append(word)
+    return words
+
+
+# The model of a worker process, loaded once by _init_worker.
+_worker_model = None
+
+
+def _init_worker(model_name: str, quantize: bool, n_threads: int) -> None:
+    global _worker_model
+    limit_threads(n_threads)
+    _worker_model = load_model(model_name, quantize)
+
+
+def _transcribe_chunk(audio_chunk: np.ndarray, whisper_lang_code: str) -> list[dict]:
+    # Transcribe a chunk in a worker process. Word times are relative to the chunk.
+    return transcribe_regions(
+        _worker_model, audio_chunk, [(0, audio_chunk.shape[0])], whisper_lang_code
+    )
+
+
+def slice_audio(
+    audio: np.ndarray, time_start: pd.Timedelta, time_end: pd.Timedelta
+) -> np.ndarray:
+    # Return the samples of a decoded audio (see whisper.load_audio) between two times.
+    # The slice is a view, so no samples are copied.
+    sample_start = round(time_start.total_seconds() * whisper.audio.SAMPLE_RATE)
+    sample_end = round(time_end.total_seconds() * whisper.audio.SAMPLE_RATE)
+    return audio[sample_start:sample_end]
 
 
 if __name__ == "__main__":
@@ -13,6 +13,15 @@ api = HfApi()
 #     repo_type="dataset",
 # )
 
+# Upload the sharded version, output of export_shards.py (which can also upload it
+# with --repo_id)
+# api.upload_folder(
+#     folder_path="/path/to/DRAL-8.0-shards",
+#     repo_id="jonavila/DRAL",
+#     path_in_repo=".",
+#     repo_type="dataset",
+# )
+
 # Upload the unarchived version
 api.upload_folder(
     folder_path="/path/to/DRAL-8.0",
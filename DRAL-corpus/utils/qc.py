@@ -0,0 +1,52 @@
+# Quality control statistics of audio files, computed with NumPy in a single read.
+
+import numpy as np
+from scipy.io import wavfile
+from utils.vad import frame_energy_db
+
+
+def audio_stats(
+    path_audio: str, silence_threshold_db: float = -50, frame_ms: float = 30
+) -> dict:
+    """Read a WAV file once and compute its duration, silence ratio, clipping rate, and
+    root mean square energy.
+
+    Args:
+        path_audio (str): Path to a WAV file.
+        silence_threshold_db (float, optional): Frames with energy below this level, in
+            decibels relative to full scale, are silent. Defaults to -50.
+        frame_ms (float, optional): Frame length in milliseconds for the silence ratio.
+            Defaults to 30.
+
+    Returns:
+        dict: "duration" in seconds, "silence_ratio" (fraction of silent frames),
+            "clipping_rate" (fraction of samples at full scale), and "rms_db" (root
+            mean square energy in decibels relative to full scale).
+    """
+    sample_rate, signal = wavfile.read(path_audio)
+
+    # Scale integer samples to [-1, 1), and mix down to mono.
+    if np.issubdtype(signal.dtype, np.integer):
+        full_scale = np.iinfo(signal.dtype).max + 1
+        signal = signal.astype(np.float32) / full_scale
+    if signal.ndim > 1:
+        signal = signal.mean(axis=1)
+
+    if signal.size == 0:
+        return {
+            "duration": 0.0,
+            "silence_ratio": 1.0,
+            "clipping_rate": 0.0,
+            "rms_db": -200.0,
+        }
+
+    energy_db = frame_energy_db(signal, sample_rate, frame_ms)
+    rms = np.sqrt(np.mean(np.square(signal, dtype=np.float64)))
+    return {
+        "duration": signal.shape[0] / sample_rate,
+        "silence_ratio": float(np.mean(energy_db < silence_threshold_db))
+        if energy_db.size
+        else 1.0,
+        "clipping_rate": float(np.mean(np.abs(signal) >= 0.999)),
+        "rms_db": float(20 * np.log10(max(rms, 1e-10))),
+    }
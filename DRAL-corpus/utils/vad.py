@@ -0,0 +1,150 @@
+# Energy-based voice activity detection for decoded audio (NumPy arrays).
+
+import numpy as np
+
+
+def frame_energy_db(
+    audio: np.ndarray, sample_rate: int, frame_ms: float = 30
+) -> np.ndarray:
+    """Compute the energy of non-overlapping frames of an audio, in decibels.
+
+    Args:
+        audio (np.ndarray): Mono audio samples.
+        sample_rate (int): Sample rate of the audio in Hz.
+        frame_ms (float, optional): Frame length in milliseconds. Defaults to 30. The
+            trailing samples that do not fill a frame are ignored.
+
+    Returns:
+        np.ndarray: Root mean square energy of each frame, in decibels.
+    """
+    frame_len = round(sample_rate * frame_ms / 1000)
+    n_frames = audio.shape[0] // frame_len
+    frames = audio[: n_frames * frame_len].reshape(n_frames, frame_len)
+    rms = np.sqrt(np.mean(np.square(frames, dtype=np.float64), axis=1))
+    # Avoid taking the log of zero for digital silence.
+    return 20 * np.log10(np.maximum(rms, 1e-10))
+
+
+def find_speech_regions(
+    audio: np.ndarray,
+    sample_rate: int,
+    threshold_db: float = -40,
+    min_db: float = -80,
+    padding_s: float = 0.5,
+    min_gap_s: float = 2,
+    frame_ms: float = 30,
+) -> np.ndarray:
+    """Find the regions of an audio that likely contain speech, i.e. runs of frames with
+    energy above a threshold relative to the loudest frame and above an absolute floor.
+
+    Args:
+        audio (np.ndarray): Mono audio samples.
+        sample_rate (int): Sample rate of the audio in Hz.
+        threshold_db (float, optional): Energy threshold in decibels, relative to the
+            energy of the loudest frame. Defaults to -40.
+        min_db (float, optional): Absolute energy floor in decibels relative to full
+            scale (samples in [-1, 1]). Frames below it are never speech, so silent
+            audio, whose loudest frame is itself silent, has no regions. Defaults to
+            -80.
+        padding_s (float, optional): Seconds added before and after each region, so
+            soft word onsets and endings are kept. Defaults to 0.5.
+        min_gap_s (float, optional): Regions separated by less than this many seconds
+            (after padding) are merged. Defaults to 2.
+        frame_ms (float, optional): Frame length in milliseconds. Defaults to 30.
+
+    Returns:
+        np.ndarray: Array of shape (n_regions, 2) with the start and end sample of each
+            region, sorted and non-overlapping. Empty if the audio is silent, i.e. no
+            frame is above `min_db`.
+    """
+    energy_db = frame_energy_db(audio, sample_rate, frame_ms)
+    if energy_db.size == 0:
+        return np.empty((0, 2), dtype=np.int64)
+
+    is_speech = (energy_db > energy_db.max() + threshold_db) & (energy_db > min_db)
+    if not is_speech.any():
+        return np.empty((0, 2), dtype=np.int64)
+
+    # Find the first and one-past-last frames of each run of speech frames.
+    is_speech_padded = np.concatenate(([False], is_speech, [False]))
+    edges = np.flatnonzero(np.diff(is_speech_padded.astype(np.int8)))
+    frame_starts, frame_ends = edges[0::2], edges[1::2]
+
+    # Convert frames to samples and pad.
+    frame_len = round(sample_rate * frame_ms / 1000)
+    padding = round(padding_s * sample_rate)
+    starts = np.maximum(frame_starts * frame_len - padding, 0)
+    ends = np.minimum(frame_ends * frame_len + padding, audio.shape[0])
+
+    # Merge regions separated by short gaps. The runs do not overlap and are padded
+    # equally, so both starts and ends are sorted.
+    is_new_region = starts[1:] - ends[:-1] >= round(min_gap_s * sample_rate)
+    starts = np.concatenate((starts[:1], starts[1:][is_new_region]))
+    ends = np.concatenate((ends[:-1][is_new_region], ends[-1:]))
+
+    return np.stack((starts, ends), axis=1)
+
+
+def split_regions(
+    audio: np.ndarray,
+    sample_rate: int,
+    regions: np.ndarray,
+    chunk_s: float = 120,
+    overlap_s: float = 2,
+    search_s: float = 10,
+    frame_ms: float = 30,
+) -> tuple[np.ndarray, np.ndarray]:
+    """Split long regions of an audio into overlapping chunks, cutting at the frame with
+    the lowest energy near each chunk boundary, so words are unlikely to be cut.
+
+    Args:
+        audio (np.ndarray): Mono audio samples.
+        sample_rate (int): Sample rate of the audio in Hz.
+        regions (np.ndarray): Array of shape (n_regions, 2) with the start and end
+            sample of each region, e.g. from find_speech_regions.
+        chunk_s (float, optional): Target chunk length in seconds. Regions shorter than
+            this are not split. Defaults to 120.
+        overlap_s (float, optional): Seconds each chunk extends past its cuts, so words
+            at a cut are transcribed in full by at least one chunk. Defaults to 2.
+        search_s (float, optional): Seconds before and after each target boundary to
+            search for the lowest-energy frame. Defaults to 10.
+        frame_ms (float, optional): Frame length in milliseconds. Defaults to 30.
+
+    Returns:
+        tuple[np.ndarray, np.ndarray]: Two arrays of shape (n_chunks, 2), in samples.
+            The first has the chunks including their overlap. The second has the
+            intervals the chunks own, which tile the regions without overlap; a word
+            transcribed from a chunk should be kept only if it falls in the chunk's
+            owned interval.
+    """
+    energy_db = frame_energy_db(audio, sample_rate, frame_ms)
+    frame_len = round(sample_rate * frame_ms / 1000)
+    chunk_len = round(chunk_s * sample_rate)
+    search_len = round(search_s * sample_rate)
+    overlap = round(overlap_s * sample_rate)
+
+    chunks = []
+    owned = []
+    for region_start, region_end in regions:
+        cuts = [region_start]
+        while region_end - cuts[-1] > chunk_len:
+            target = cuts[-1] + chunk_len
+            frame_lo = (target - search_len) // frame_len
+            frame_hi = min(target + search_len, region_end) // frame_len
+            frame_cut = frame_lo + np.argmin(energy_db[frame_lo:frame_hi])
+            cuts.append(frame_cut * frame_len)
+        cuts.append(region_end)
+
+        for cut_start, cut_end in zip(cuts[:-1], cuts[1:]):
+            chunks.append(
+                (
+                    max(cut_start - overlap, region_start),
+                    min(cut_end + overlap, region_end),
+                )
+            )
+            owned.append((cut_start, cut_end))
+
+    return (
+        np.array(chunks, dtype=np.int64).reshape(-1, 2),
+        np.array(owned, dtype=np.int64).reshape(-1, 2),
+    )
@@ -0,0 +1,22 @@
+# Thread limits for the workers of process pools that run torch and NumPy code.
+#
+# torch and the BLAS libraries used by NumPy and scikit-learn each start one thread per
+# core by default, so N worker processes would start N threads per core and
+# oversubscribe the CPU. Each worker is instead limited to its share of the cores.
+
+import os
+
+import torch
+from threadpoolctl import threadpool_limits
+
+
+def threads_per_worker(n_workers: int) -> int:
+    # Number of threads for each of `n_workers` worker processes, at least one.
+    return max(os.cpu_count() // n_workers, 1)
+
+
+def limit_threads(n_threads: int) -> None:
+    # Limit the threads of torch and BLAS in this process, e.g. in a pool initializer,
+    # with `n_threads` from threads_per_worker.
+    torch.set_num_threads(n_threads)
+    threadpool_limits(n_threads)
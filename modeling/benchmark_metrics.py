@@ -0,0 +1,96 @@
+# Benchmark the batched distances of metrics.py with NumPy and torch, at 1x, 10x, and
+# 100x the number of short fragments in the release. The throughput of computing the
+# distances one pair at a time in Python, as the k-NN model's metric did, is printed
+# for comparison.
+
+import argparse
+import time
+from typing import Callable
+
+import consts
+import data
+import metrics
+import numpy as np
+import pandas as pd
+import torch
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Measure the throughput (rows per second) of the distances in "
+        "metrics.py on random features.",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+    )
+    parser.add_argument(
+        "--n_features",
+        help="Number of features per row (10 base codes times 10 spans).",
+        type=int,
+        default=100,
+    )
+    parser.add_argument(
+        "--scales",
+        help="Multiples of the number of short fragments to benchmark.",
+        type=int,
+        nargs="+",
+        default=[1, 10, 100],
+    )
+    parser.add_argument(
+        "--n_repeats",
+        help="Number of timed runs per benchmark; the fastest is reported.",
+        type=int,
+        default=3,
+    )
+    args = parser.parse_args()
+
+    n_frags = pd.read_csv(data.PATH_METADATA_SHORT, usecols=["id"]).shape[0]
+    base_codes = list(data.FEATURE_BASE_CODE_TO_NAMES.keys())
+    groups = np.resize(base_codes, args.n_features)
+    rng = np.random.default_rng(consts.RANDOM_STATE_VAL)
+
+    distances = {
+        "mean Euclidean": metrics.mean_euclidean_distance,
+        "Euclidean by base code": lambda X1, X2: metrics.euclidean_distance_by_group(
+            X1, X2, groups
+        ),
+        "cosine": metrics.cosine_distance,
+    }
+
+    for scale in args.scales:
+        n_rows = n_frags * scale
+        X1 = rng.standard_normal((n_rows, args.n_features), dtype=np.float32)
+        X2 = rng.standard_normal((n_rows, args.n_features), dtype=np.float32)
+        inputs = {
+            "NumPy float32": (X1, X2),
+            "NumPy float64": (X1.astype(np.float64), X2.astype(np.float64)),
+            "torch float32": (torch.from_numpy(X1), torch.from_numpy(X2)),
+        }
+        print(f"{scale}x fragments ({n_rows} rows, {args.n_features} features):")
+        for distance_name, distance in distances.items():
+            for input_name, (A, B) in inputs.items():
+                seconds = time_fastest(lambda: distance(A, B), args.n_repeats)
+                print(
+                    f"\t{distance_name}, {input_name}: "
+                    f"{n_rows / seconds:,.0f} rows/s"
+                )
+
+    # One Python call per pair, on a sample, since it is too slow for large scales.
+    n_rows = min(n_frags, 10000)
+    seconds = time_fastest(
+        lambda: [metrics.euclidean_distance_1D(X1[i], X2[i]) for i in range(n_rows)],
+        args.n_repeats,
+    )
+    print(f"Per-pair Python loop, NumPy float32: {n_rows / seconds:,.0f} rows/s")
+
+
+def time_fastest(func: Callable, n_repeats: int) -> float:
+    # Return the fastest wall time of `n_repeats` calls, in seconds.
+    seconds = []
+    for _ in range(n_repeats):
+        time_start = time.perf_counter()
+        func()
+        seconds.append(time.perf_counter() - time_start)
+    return min(seconds)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,6 +1,6 @@
 import numpy as np
 import pandas as pd
-from metrics import euclidean_distance_2D
+from metrics import euclidean_distance_2D, pairwise_euclidean_distance
 
 
 class SimilarityException(Exception):
@@ -78,15 +78,15 @@ def similarity(df_features: pd.DataFrame) -> pd.DataFrame:
         scores as values.
     """
 
-    # Convert features to a Numpy array.
-    arr_features = df_features.to_numpy()
-
-    # Empty array to store similarity scores.
-    arr_similarity = np.empty([df_features.shape[0], df_features.shape[0]])
+    # Convert features to a Numpy array, in float64 since the features may be float32
+    # (see feature_store.py), which is not precise enough for the distances of close
+    # fragments computed by matrix multiplication.
+    arr_features = df_features.to_numpy(dtype=np.float64)
 
-    for i in range(arr_features.shape[0]):
-        row = arr_features[i, :]
-        arr_similarity[i, :] = euclidean_distance_2D(row, arr_features)
+    # Compute the distances between all pairs of fragments at once.
+    arr_similarity = pairwise_euclidean_distance(arr_features, arr_features)
+    # A fragment is identical to itself, without rounding errors.
+    np.fill_diagonal(arr_similarity, 0)
 
     # Store in a DataFrame.
     df_similarity = pd.DataFrame(
@@ -2,6 +2,14 @@ from pathlib import Path
 from typing import Optional
 
 import pandas as pd
+from feature_store import (
+    read_features_df,
+    read_schema,
+    read_store,
+    split_columns,
+    take_rows_df,
+)
+from pairs import pair_rows, read_pair_index
 from sklearn.preprocessing import StandardScaler
 
 DIR_ROOT = Path(__file__).parent.parent.resolve()
@@ -9,7 +17,11 @@ DIR_ROOT = Path(__file__).parent.parent.resolve()
 
 # Paths to outputs of DRAL post-processing scripts.
 DIR_RELEASE = DIR_ROOT.joinpath("DRAL-corpus/release")
+PATH_METADATA_SHORT = DIR_RELEASE.joinpath("fragments-short.csv")
 PATH_METADATA_SHORT_FULL = DIR_RELEASE.joinpath("fragments-short-full.csv")
+PATH_WORDS_SHORT = DIR_RELEASE.joinpath(
+    "fragments-short-matlab-transcribed-words.parquet"
+)
 
 # Paths to outputs of feature computation scripts.
 PATH_FEATURES = DIR_RELEASE.joinpath("features/features.csv")
@@ -75,58 +87,114 @@ def write_metadata(df_frags: pd.DataFrame) -> None:
     df_frags.to_csv(PATH_METADATA_SHORT_FULL)
 
 
+def read_words(method: int = 1) -> pd.DataFrame:
+    # Read the word timestamps of one transcription method (1 or 2), written by
+    # transcribe_fragments.py. The returned DataFrame is indexed by (frag_id, word_idx)
+    # and has the columns: text, time_start, time_end, probability. Times are in seconds
+    # relative to the start of the fragment. Select the words of a fragment with
+    # `df_words.loc[frag_id]`, and compute per-fragment aggregates with
+    # `df_words.groupby(level="frag_id")`.
+    df_words = pd.read_parquet(
+        PATH_WORDS_SHORT,
+        columns=[
+            "frag_id",
+            "word_idx",
+            "text",
+            "time_start",
+            "time_end",
+            "probability",
+        ],
+        filters=[("method", "==", method)],
+    )
+    df_words = df_words.set_index(["frag_id", "word_idx"]).sort_index()
+    return df_words
+
+
 def read_features_en_es(
     path_subset: Optional[Path] = None,
+    base_codes: Optional[list[str]] = None,
+    spans: Optional[list[str]] = None,
 ) -> tuple[pd.DataFrame, pd.DataFrame]:
     # Read CSV containing computed features, output of feature computation scripts, and
-    # return as two DataFrames, one per language, with matching rows.
+    # return as two DataFrames, one per language, with matching rows (paired by
+    # `trans_id` in the release metadata).
     #
     # Return a subset if specified. `path_subset` is path to a CSV containing short
     # fragment IDs.
+    #
+    # Return only some features if specified, e.g. `base_codes=["tl", "th"]` for the
+    # pitch features or `spans=["0-5"]`. Only those columns are read from disk.
+
+    if base_codes is not None:
+        _check_base_codes(base_codes)
+    values, frag_ids, columns = read_store(PATH_FEATURES, "Row", base_codes, spans)
 
-    lang_code_en = "EN"
-    lang_code_es = "ES"
-    df_features = _features_csv_to_df(PATH_FEATURES)
+    # Align the rows of each EN fragment and its ES translation.
+    rows_en, rows_es = pair_rows(frag_ids, read_pair_index(PATH_METADATA_SHORT))
 
-    # If a subset is specified, keep only those fragments.
+    # If a subset is specified, keep only the pairs with both fragments in it.
     if path_subset:
 
         # Read the CSV file at path_subset into a list of strings. The CSV contains only IDs.
         df_subset = pd.read_csv(path_subset, header=None, names=["frag_id"])
 
-        # Drop rows from df_features with index that are not in df_subset.
-        df_features = df_features[df_features.index.isin(df_subset["frag_id"])]
+        is_in_subset = pd.Index(frag_ids).isin(df_subset["frag_id"])
+        is_pair_in_subset = is_in_subset[rows_en] & is_in_subset[rows_es]
+        rows_en = rows_en[is_pair_in_subset]
+        rows_es = rows_es[is_pair_in_subset]
 
-    # Split the DataFrame into two, one per language. Assume there are matching rows.
-    is_en = df_features.index.str.startswith(lang_code_en)
-    df_features_en = df_features[is_en]
-    frag_ids_en = list(df_features_en.index.values)
-    frag_ids_es = [
-        frag_id.replace(lang_code_en, lang_code_es) for frag_id in frag_ids_en
-    ]
-    df_features_es = df_features.loc[frag_ids_es]
+    df_features_en = take_rows_df(values, frag_ids, columns, rows_en)
+    df_features_es = take_rows_df(values, frag_ids, columns, rows_es)
 
     return df_features_en, df_features_es
 
 
 def _features_csv_to_df(path_features_csv: Path) -> pd.DataFrame:
     # Read a fragments features CSV, created by MATLAB feature computation script, into
-    # a pandas DataFrame. The column `Row` contains the fragment IDs.
-    df_features = pd.read_csv(path_features_csv, index_col="Row")
+    # a pandas DataFrame. The column `Row` contains the fragment IDs. The CSV is parsed
+    # only when it changes, see feature_store.py.
+    df_features = read_features_df(path_features_csv)
     return df_features
 
 
-def feature_cols_by_type(df_features: pd.DataFrame) -> tuple[dict, dict]:
-    cols = list(df_features.columns)
-    by_base_feature = {}
-    by_span = {}
-    for col in cols:
-        base_feature, span = col.split("-", 1)
-        by_base_feature.setdefault(base_feature, []).append(col)
-        by_span.setdefault(span, []).append(col)
+def read_feature_schema() -> pd.MultiIndex:
+    # Read the schema of the computed features: a MultiIndex with the levels "base_code"
+    # (see FEATURE_BASE_CODE_TO_NAMES) and "span", in the order of the feature columns.
+    return read_schema(PATH_FEATURES)
+
+
+def feature_cols_by_type(
+    df_features: pd.DataFrame, schema: Optional[pd.MultiIndex] = None
+) -> tuple[dict, dict]:
+    # Group the feature columns of a DataFrame by base code and by span, in the order of
+    # the columns. `schema` is the schema of the columns, e.g. read once with
+    # read_feature_schema for DataFrames with all the computed features. If None, it is
+    # split from the column names, e.g. for principal components, which have an empty
+    # span.
+    if schema is None:
+        schema = split_columns(df_features.columns)
+    elif len(schema) != df_features.shape[1]:
+        raise ValueError(
+            f"Schema has {len(schema)} columns, features have {df_features.shape[1]}."
+        )
+    series_cols = pd.Series(df_features.columns, index=schema)
+    by_base_feature = {
+        base_code: series.to_list()
+        for base_code, series in series_cols.groupby(level="base_code", sort=False)
+    }
+    by_span = {
+        span: series.to_list()
+        for span, series in series_cols.groupby(level="span", sort=False)
+    }
     return by_base_feature, by_span
 
 
+def _check_base_codes(base_codes: list[str]) -> None:
+    unknown = set(base_codes) - FEATURE_BASE_CODE_TO_NAMES.keys()
+    if unknown:
+        raise ValueError(f"Unknown feature base codes: {sorted(unknown)}")
+
+
 def standardize_features(df_features: pd.DataFrame) -> pd.DataFrame:
     """Standardize features by removing the mean and scaling to unit variance.
 
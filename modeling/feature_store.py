@@ -0,0 +1,197 @@
+# Binary store of feature CSVs written by MATLAB (features.csv and the PCA outputs), so
+# scripts do not parse the wide CSVs as text on every start.
+#
+# A CSV is converted once into two files next to it:
+#   <stem>.npy        the feature values, float32, one row per fragment, stored column
+#                     by column (Fortran order)
+#   <stem>-index.npz  the fragment IDs, the column names and their schema, and the
+#                     modification time and size of the source CSV
+# The store is rebuilt when the source CSV changes, and its values are memory-mapped on
+# read, so reading a few columns only reads those columns from disk.
+#
+# The schema of a column named "<base code>-<span>", e.g. "tl-0-5", is its base code
+# ("tl", see data.FEATURE_BASE_CODE_TO_NAMES) and span ("0-5"). Columns without a span,
+# e.g. principal components, have an empty span.
+
+import os
+import tempfile
+from pathlib import Path
+from typing import Optional
+
+import numpy as np
+import pandas as pd
+
+
+def get_store_paths(path_csv: Path) -> tuple[Path, Path]:
+    # Paths of the values and index files of a CSV's store.
+    path_csv = Path(path_csv)
+    return (
+        path_csv.with_suffix(".npy"),
+        path_csv.with_name(f"{path_csv.stem}-index.npz"),
+    )
+
+
+def is_store_current(path_csv: Path) -> bool:
+    # Whether the store of a CSV exists and was built from its current version.
+    path_values, path_index = get_store_paths(path_csv)
+    if not (path_values.exists() and path_index.exists()):
+        return False
+    stat = os.stat(path_csv)
+    with np.load(path_index) as index_file:
+        return (
+            # Stores written before the schema was added are rebuilt.
+            "base_codes" in index_file
+            and int(index_file["source_mtime_ns"]) == stat.st_mtime_ns
+            and int(index_file["source_size"]) == stat.st_size
+        )
+
+
+def build_store(path_csv: Path, index_col: str = "Row") -> None:
+    """Convert a feature CSV into its binary store.
+
+    Args:
+        path_csv (Path): Path to a feature CSV, with one row per fragment.
+        index_col (str, optional): Column with the fragment IDs. Defaults to "Row", the
+            column written by MATLAB.
+    """
+    path_values, path_index = get_store_paths(path_csv)
+    stat = os.stat(path_csv)
+    df_features = pd.read_csv(path_csv, index_col=index_col)
+
+    # Split the column names into their schema once, here.
+    columns = df_features.columns.to_numpy(dtype=str)
+    schema = split_columns(columns)
+
+    # Write to temporary files first, so an interrupted build is never read as current.
+    # Their names are unique, so concurrent builds do not write over each other's.
+    paths_tmp = []
+    try:
+        with tempfile.NamedTemporaryFile(
+            dir=path_values.parent, prefix=f"{path_values.stem}-", delete=False
+        ) as file_values_tmp:
+            paths_tmp.append(file_values_tmp.name)
+            np.save(
+                file_values_tmp,
+                np.asfortranarray(df_features.to_numpy(dtype=np.float32)),
+            )
+        with tempfile.NamedTemporaryFile(
+            dir=path_index.parent, prefix=f"{path_index.stem}-", delete=False
+        ) as file_index_tmp:
+            paths_tmp.append(file_index_tmp.name)
+            np.savez(
+                file_index_tmp,
+                ids=df_features.index.to_numpy(dtype=str),
+                columns=columns,
+                base_codes=schema.get_level_values("base_code").to_numpy(dtype=str),
+                spans=schema.get_level_values("span").to_numpy(dtype=str),
+                source_mtime_ns=stat.st_mtime_ns,
+                source_size=stat.st_size,
+            )
+        os.replace(paths_tmp[0], path_values)
+        os.replace(paths_tmp[1], path_index)
+    finally:
+        for path_tmp in paths_tmp:
+            Path(path_tmp).unlink(missing_ok=True)
+
+
+def read_store(
+    path_csv: Path,
+    index_col: str = "Row",
+    base_codes: Optional[list[str]] = None,
+    spans: Optional[list[str]] = None,
+) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Read the binary store of a feature CSV, building it first if it is missing or
+    older than the CSV.
+
+    Args:
+        path_csv (Path): Path to a feature CSV, with one row per fragment.
+        index_col (str, optional): Column with the fragment IDs. Defaults to "Row".
+        base_codes (Optional[list[str]], optional): Read only the columns with these
+            base codes, e.g. ["tl", "th"]. Defaults to None, all base codes.
+        spans (Optional[list[str]], optional): Read only the columns with these spans,
+            e.g. ["0-5"]. Defaults to None, all spans.
+
+    Returns:
+        tuple[np.ndarray, np.ndarray, np.ndarray]: The feature values (float32) with
+            shape (n_frags, n_features), the fragment IDs, and the column names. The
+            values are read-only and memory-mapped if no columns are filtered out.
+    """
+    if not is_store_current(path_csv):
+        build_store(path_csv, index_col)
+    path_values, path_index = get_store_paths(path_csv)
+    with np.load(path_index) as index_file:
+        ids = index_file["ids"]
+        columns = index_file["columns"]
+        is_selected = select_columns(
+            index_file["base_codes"], index_file["spans"], base_codes, spans
+        )
+    values = np.load(path_values, mmap_mode="r")
+    if is_selected.all():
+        return values, ids, columns
+    return values[:, is_selected], ids, columns[is_selected]
+
+
+def read_schema(path_csv: Path, index_col: str = "Row") -> pd.MultiIndex:
+    # Read the schema of a feature CSV's columns from its store, as a MultiIndex with
+    # the levels "base_code" and "span", in the order of the columns.
+    if not is_store_current(path_csv):
+        build_store(path_csv, index_col)
+    _, path_index = get_store_paths(path_csv)
+    with np.load(path_index) as index_file:
+        return pd.MultiIndex.from_arrays(
+            [index_file["base_codes"], index_file["spans"]],
+            names=["base_code", "span"],
+        )
+
+
+def split_columns(columns: np.ndarray) -> pd.MultiIndex:
+    # Split column names into their schema (see the top of this file), as a MultiIndex
+    # with the levels "base_code" and "span", in the order of the columns. The store
+    # keeps the schema of its columns, see read_schema.
+    base_codes, _, spans = np.char.partition(np.asarray(columns, dtype=str), "-").T
+    return pd.MultiIndex.from_arrays([base_codes, spans], names=["base_code", "span"])
+
+
+def select_columns(
+    base_codes_cols: np.ndarray,
+    spans_cols: np.ndarray,
+    base_codes: Optional[list[str]] = None,
+    spans: Optional[list[str]] = None,
+) -> np.ndarray:
+    # Whether each column, with the given base code and span, passes the filters.
+    is_selected = np.ones(base_codes_cols.shape[0], dtype=bool)
+    if base_codes is not None:
+        is_selected &= np.isin(base_codes_cols, base_codes)
+    if spans is not None:
+        is_selected &= np.isin(spans_cols, spans)
+    return is_selected
+
+
+def read_features_df(
+    path_csv: Path,
+    index_col: str = "Row",
+    base_codes: Optional[list[str]] = None,
+    spans: Optional[list[str]] = None,
+) -> pd.DataFrame:
+    # Read a feature CSV from its binary store, as a DataFrame indexed by fragment ID,
+    # like `pd.read_csv(path_csv, index_col=index_col)` but with float32 values and
+    # optionally only some columns, see read_store. The values are copied into memory,
+    # so the DataFrame is writable.
+    values, ids, columns = read_store(path_csv, index_col, base_codes, spans)
+    return pd.DataFrame(
+        np.array(values), index=pd.Index(ids, name=index_col), columns=columns
+    )
+
+
+def take_rows_df(
+    values: np.ndarray,
+    frag_ids: np.ndarray,
+    columns: np.ndarray,
+    rows: np.ndarray,
+    index_col: str = "Row",
+) -> pd.DataFrame:
+    # Select rows of a store by integer position, e.g. from pairs.pair_rows, as a
+    # DataFrame indexed by fragment ID.
+    return pd.DataFrame(
+        values[rows], index=pd.Index(frag_ids[rows], name=index_col), columns=columns
+    )
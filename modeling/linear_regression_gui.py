@@ -6,6 +6,7 @@ import tkinter.ttk as ttk
 import data
 import pandas as pd
 from metrics import euclidean_distance_2D
+from pairs import read_pair_index
 from sox.core import play
 
 
@@ -41,6 +42,9 @@ class Application(tk.Frame):
 
         self.master = master
 
+        # The translation of each fragment, to show with its prediction.
+        self.df_pairs = read_pair_index(data.PATH_METADATA_SHORT)
+
         frame_main = ScrollableFrame(self.master)
 
         # notebook_test_type = ttk.Notebook(self.master)
@@ -96,10 +100,7 @@ class Application(tk.Frame):
 
             frag_id_output = df_diff.index[i]
             score = df_diff.iloc[i]["similarity"]
-            if "EN" in frag_id_output:
-                frag_id_input = frag_id_output.replace("EN", "ES")
-            elif "ES" in frag_id_output:
-                frag_id_input = frag_id_output.replace("ES", "EN")
+            frag_id_input = self.df_pairs.at[frag_id_output, "trans_id"]
 
             frame_frag_input = self.create_fragment_frame(
                 frame_pair, frag_id_input, None
@@ -29,7 +29,9 @@ print(f"Mean: {coefs.mean():+.2f}")
 print(f"Maximum: {coefs.max():+} ({coefs.idxmax()})")
 print(f"Minimum: {coefs.min():+} ({coefs.idxmin()})")
 
-by_base_feature, by_span = data.feature_cols_by_type(df_features)
+by_base_feature, by_span = data.feature_cols_by_type(
+    df_features, data.read_feature_schema()
+)
 
 # TODO Duplicate code (will be displayed in figure).
 print("Mean correlation by base feature:")
@@ -1,49 +1,124 @@
+# Distances between prosody representations (feature vectors), batched over rows.
+#
+# Every function accepts NumPy arrays (or DataFrames, which are converted to arrays) and
+# torch tensors, and returns the same type with the same dtype as its inputs, so the
+# models, the GUIs, and the neural network loss share one implementation. Inputs are
+# broadcast, e.g. the distances of one vector to each row of a matrix are
+# `euclidean_distance_2D(x, X)`.
+
+from typing import Union
+
 import numpy as np
+import pandas as pd
 import torch
 
+Array = Union[np.ndarray, pd.DataFrame, torch.Tensor]
 
-def euclidean_distance_2D(X1: np.ndarray, X2: np.ndarray):
-    difference = np.subtract(X1, X2)
+# Avoids dividing by zero for all-zero vectors in cosine_distance.
+EPS = 1e-12
 
-    # The "axis" argument specifies the axis which to compute the vector norm, in this
-    # case the rows. The "org" argument specifies the order of the norm, in this case
-    # the 2-norm, or Euclidean norm: $||x||_2 := \sqrt{x_1^2 + \cdots + x_n^2}$
-    euclidean_distances = np.linalg.norm(difference, axis=1)
 
-    return euclidean_distances
+def euclidean_distance_2D(X1: Array, X2: Array) -> Array:
+    # Return the Euclidean distance between corresponding rows (vectors along the last
+    # axis) of two arrays: $||x||_2 := \sqrt{x_1^2 + \cdots + x_n^2}$
+    X1, X2 = _as_arrays(X1, X2)
+    if isinstance(X1, torch.Tensor):
+        return torch.linalg.vector_norm(X1 - X2, dim=-1)
+    return np.linalg.norm(np.subtract(X1, X2), axis=-1)
 
 
-def mean_euclidean_distance(X1: np.ndarray, X2: np.ndarray) -> np.float64:
-    # Return the mean Euclidean distance of two NumPy multidimensional, homogeneous
-    # arrays.
-    # TODO Does this function always return np.float64? Is it ever passed DataFrames?
+def mean_euclidean_distance(X1: Array, X2: Array) -> Union[np.floating, torch.Tensor]:
+    # Return the mean Euclidean distance between corresponding rows of two arrays. With
+    # tensors, the result is a differentiable scalar tensor, e.g. a loss.
     euclidean_distances = euclidean_distance_2D(X1, X2)
-    euclidean_distances_mean = np.mean(euclidean_distances)
-    return euclidean_distances_mean
-
-
-def euclidean_distance_1D(x1: np.ndarray, x2: np.ndarray) -> np.float64:
-    # Used only by the k-NN regression model for now. The user-defined metric function
-    # should "takes two arrays representing 1D vectors as inputs and must return one
-    # value indicating the distance between those vectors"
-    # https://scikit-learn.org/stable/modules/generated/sklearn.neighbors.KNeighborsRegressor.html
-
-    difference = np.subtract(x1, x2)
-
-    # The "axis" argument specifies the axis which to compute the vector norm, in this
-    # case the rows. The "org" argument specifies the order of the norm, in this case
-    # the 2-norm, or Euclidean norm: $||x||_2 := \sqrt{x_1^2 + \cdots + x_n^2}$
-    euclidean_distance = np.linalg.norm(difference)
-    euclidean_distance_rounded = round(euclidean_distance, 3)
-    return euclidean_distance_rounded
-
-
-def mean_euclidean_distance_tensor(x, y):
-    # Used only by the neural network model for now.
-    # TODO Add type hints.
-    differences = x - y
-    differences_squared = differences**2
-    differences_squared_sum = torch.sum(differences_squared, dim=1)
-    differences_squared_sum_sqrt = torch.sqrt(differences_squared_sum)
-    differences_squared_sum_sqrt_mean = torch.mean(differences_squared_sum_sqrt)
-    return differences_squared_sum_sqrt_mean
+    if isinstance(euclidean_distances, torch.Tensor):
+        return torch.mean(euclidean_distances)
+    return np.mean(euclidean_distances)
+
+
+def euclidean_distance_1D(x1: np.ndarray, x2: np.ndarray) -> np.floating:
+    # Return the Euclidean distance between two 1D vectors, e.g. as the user-defined
+    # metric of a scikit-learn estimator.
+    return euclidean_distance_2D(x1, x2)
+
+
+def pairwise_euclidean_distance(X1: Array, X2: Array) -> Array:
+    """Compute the Euclidean distance between every row of one array and every row of
+    another, with one matrix multiplication.
+
+    Args:
+        X1 (Array): Array of shape (n1, n_features).
+        X2 (Array): Array of shape (n2, n_features).
+
+    Returns:
+        Array: Distances of shape (n1, n2).
+    """
+    X1, X2 = _as_arrays(X1, X2)
+    # $||x1 - x2||^2 = ||x1||^2 + ||x2||^2 - 2 x1 \cdot x2$. Distances do not change
+    # when both arrays are shifted by the same vector, so both are centered on the mean
+    # of X2 first: the norms are then smaller, and so is the cancellation error for
+    # close rows. The squares are clamped at zero before the square root, since rounding
+    # can still make them slightly negative for near-identical rows.
+    if isinstance(X1, torch.Tensor):
+        mean = torch.mean(X2, dim=0)
+        X1, X2 = X1 - mean, X2 - mean
+        sq_norms1 = torch.sum(X1 * X1, dim=1)
+        sq_norms2 = torch.sum(X2 * X2, dim=1)
+        sq_distances = sq_norms1[:, None] + sq_norms2[None, :] - 2 * (X1 @ X2.T)
+        return torch.sqrt(torch.clamp(sq_distances, min=0))
+    mean = np.mean(X2, axis=0)
+    X1, X2 = X1 - mean, X2 - mean
+    sq_norms1 = np.einsum("ij,ij->i", X1, X1)
+    sq_norms2 = np.einsum("ij,ij->i", X2, X2)
+    sq_distances = sq_norms1[:, None] + sq_norms2[None, :] - 2 * (X1 @ X2.T)
+    return np.sqrt(np.maximum(sq_distances, 0))
+
+
+def euclidean_distance_by_group(X1: Array, X2: Array, groups: np.ndarray) -> Array:
+    """Compute the Euclidean distance between corresponding rows of two arrays, over
+    each group of features separately, e.g. over the features of each base code (see
+    data.read_feature_schema).
+
+    Args:
+        X1 (Array): Array of shape (n, n_features).
+        X2 (Array): Array of shape (n, n_features).
+        groups (np.ndarray): Group of each feature, e.g. its base code.
+
+    Returns:
+        Array: Distances of shape (n, n_groups). Column j is the distance over the
+            features of group `pd.unique(groups)[j]`, i.e. groups are in order of first
+            appearance.
+    """
+    X1, X2 = _as_arrays(X1, X2)
+    codes, group_names = pd.factorize(np.asarray(groups))
+
+    # Sum the squared differences of each group with one matrix multiplication.
+    membership = np.zeros((codes.shape[0], group_names.shape[0]))
+    membership[np.arange(codes.shape[0]), codes] = 1
+    if isinstance(X1, torch.Tensor):
+        membership = torch.as_tensor(membership, dtype=X1.dtype, device=X1.device)
+        return torch.sqrt(((X1 - X2) ** 2) @ membership)
+    membership = membership.astype(np.result_type(X1, X2))
+    return np.sqrt(np.square(np.subtract(X1, X2)) @ membership)
+
+
+def cosine_distance(X1: Array, X2: Array) -> Array:
+    # Return the cosine distance (1 - cosine similarity) between corresponding rows of
+    # two arrays.
+    X1, X2 = _as_arrays(X1, X2)
+    if isinstance(X1, torch.Tensor):
+        dot = torch.sum(X1 * X2, dim=-1)
+        norms = torch.linalg.vector_norm(X1, dim=-1) * torch.linalg.vector_norm(
+            X2, dim=-1
+        )
+        return 1 - dot / torch.clamp(norms, min=EPS)
+    dot = np.sum(np.multiply(X1, X2), axis=-1)
+    norms = np.linalg.norm(X1, axis=-1) * np.linalg.norm(X2, axis=-1)
+    return 1 - dot / np.maximum(norms, EPS)
+
+
+def _as_arrays(X1: Array, X2: Array) -> tuple:
+    # Convert DataFrames to NumPy arrays. Tensors are returned as is.
+    if isinstance(X1, torch.Tensor) or isinstance(X2, torch.Tensor):
+        return torch.as_tensor(X1), torch.as_tensor(X2)
+    return np.asarray(X1), np.asarray(X2)
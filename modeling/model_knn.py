@@ -1,9 +1,15 @@
 # k-nearest neighbors regression model.
+#
+# The neighbors are found once, for the largest k, with a tree index and the compiled
+# Euclidean metric. The distance-weighted predictions for every k from 1 to the largest
+# k are then computed from that single neighbor search, so a sweep over k costs about
+# as much as fitting a single k.
 
 import metrics
 import models_shared
+import numpy as np
 import pandas as pd
-from sklearn.neighbors import KNeighborsRegressor
+from sklearn.neighbors import NearestNeighbors
 
 
 def main():
@@ -16,7 +22,7 @@ def main():
         df_en_test,
         df_es_train,
         df_es_test,
-        models_shared.Task.en_to_es,
+        models_shared.Task.EN_TO_ES,
     )
 
     # ES to EN
@@ -25,7 +31,7 @@ def main():
         df_es_test,
         df_en_train,
         df_en_test,
-        models_shared.Task.es_to_en,
+        models_shared.Task.ES_TO_EN,
     )
 
 
@@ -35,29 +41,73 @@ def run_task(
     df_Y_train: pd.DataFrame,
     df_Y_test: pd.DataFrame,
     task: models_shared.Task,
-):
+    n_neighbors_max: int = 20,
+) -> np.ndarray:
+    # Return the score of each k from 1 to `n_neighbors_max`.
 
     X_train_arr = df_X_train.to_numpy()
     X_test_arr = df_X_test.to_numpy()
     Y_train_arr = df_Y_train.to_numpy()
     Y_test_arr = df_Y_test.to_numpy()
 
-    # The weight function "distance" weights points by the inverse of their distance.
-    # The metric function is set to the same function used for scoring (currently mean
-    # Euclidean distance).
-    regressor = KNeighborsRegressor(
-        n_neighbors=5, weights="distance", metric=metrics.euclidean_distance_1D
-    )
-
-    regressor.fit(X_train_arr, Y_train_arr)
+    Y_pred_arr = predict_k_sweep(X_train_arr, Y_train_arr, X_test_arr, n_neighbors_max)
 
-    Y_pred_arr = regressor.predict(X_test_arr)
+    # Score the predictions of every k at once: the mean over test rows of the Euclidean
+    # distance (the same metric used to find the neighbors).
+    scores = metrics.euclidean_distance_2D(Y_pred_arr, Y_test_arr).mean(axis=1)
 
-    score = metrics.mean_euclidean_distance(Y_test_arr, Y_pred_arr)
     print(f"Running task: {task}")
-    print(f"Score: {score}")
-
-    return score
+    for n_neighbors, score in enumerate(scores, start=1):
+        print(f"k = {n_neighbors}, score: {score}")
+    print(f"Best k = {scores.argmin() + 1}, score: {scores.min()}")
+
+    return scores
+
+
+def predict_k_sweep(
+    X_train_arr: np.ndarray,
+    Y_train_arr: np.ndarray,
+    X_test_arr: np.ndarray,
+    n_neighbors_max: int,
+    algorithm: str = "ball_tree",
+) -> np.ndarray:
+    """Predict with distance-weighted k-nearest neighbors regression, for every k from 1
+    to `n_neighbors_max`, from one neighbor search.
+
+    Args:
+        X_train_arr (np.ndarray): Training predictors, shape (n_train, n_predictors).
+        Y_train_arr (np.ndarray): Training targets, shape (n_train, n_targets).
+        X_test_arr (np.ndarray): Test predictors, shape (n_test, n_predictors).
+        n_neighbors_max (int): Largest k.
+        algorithm (str, optional): Index of the training predictors, "ball_tree" or
+            "kd_tree". Defaults to "ball_tree".
+
+    Returns:
+        np.ndarray: Predictions of shape (n_neighbors_max, n_test, n_targets), where
+            predictions[k - 1] are the predictions with k neighbors. They match those of
+            KNeighborsRegressor(n_neighbors=k, weights="distance").
+    """
+    n_neighbors_max = min(n_neighbors_max, X_train_arr.shape[0])
+    index = NearestNeighbors(
+        n_neighbors=n_neighbors_max, algorithm=algorithm, metric="euclidean"
+    )
+    index.fit(X_train_arr)
+    # Both have shape (n_test, n_neighbors_max), nearest first.
+    distances, neighbors = index.kneighbors(X_test_arr)
+
+    # Weight neighbors by the inverse of their distance. As in scikit-learn, if a test
+    # row has neighbors at distance zero, only those are used. They come first, so this
+    # holds for every k.
+    has_exact_match = distances[:, :1] == 0
+    with np.errstate(divide="ignore"):
+        weights = np.where(has_exact_match, distances == 0, 1 / distances)
+
+    # The weighted sums for k neighbors are the cumulative sums over the first k.
+    # Shapes: (n_neighbors_max, n_test, n_targets) and (n_neighbors_max, n_test, 1).
+    weights = weights.T[:, :, np.newaxis]
+    weighted_sums = np.cumsum(weights * Y_train_arr[neighbors.T], axis=0)
+    weights_sums = np.cumsum(weights, axis=0)
+    return weighted_sums / weights_sums
 
 
 if __name__ == "__main__":
@@ -1,12 +1,14 @@
 # Linear regression model.
 
 from pathlib import Path
+from typing import Optional, Tuple
 
 import matplotlib.pyplot as plt
 import metrics
 import models_shared
 import numpy as np
 import pandas as pd
+from scipy.linalg import solve_triangular
 from sklearn.linear_model import LinearRegression
 
 
@@ -23,8 +25,7 @@ def main():
 
     print("***** Tasks with reduced data *****")
     dir_output_reduced = dir_output.joinpath("reduced")
-    run_task_with_reduced_data(models_shared.Task.EN_TO_ES, dir_output_reduced)
-    run_task_with_reduced_data(models_shared.Task.ES_TO_EN, dir_output_reduced)
+    run_tasks_with_reduced_data(dir_output_reduced)
 
 
 def run_tasks_with_original_features(dir_output: Path):
@@ -52,23 +53,18 @@ def run_tasks_with_original_features(dir_output: Path):
     )
 
 
-def run_task_with_reduced_data(task: models_shared.Task, dir_output: Path):
-    # Increase the number of principal components, store results, and plot. Predict the
-    # original features from the first N principal components, i.e. use the reduced
-    # features as the predictors and the original features as the targets.
-
-    dir_output.mkdir(parents=True, exist_ok=True)  # TODO Duplicate code from dirs.py.
-    path_output_plot = dir_output.joinpath(f"plot-{task.name}.png")
-
-    n_principal_components_min = 1
-    n_principal_components_max = 100  # TODO This value is hard-coded.
+def run_tasks_with_reduced_data(
+    dir_output: Path, n_principal_components_max: Optional[int] = None
+):
+    # Read the features once, and run the tasks with reduced data in both directions.
+    # `n_principal_components_max` is the largest number of principal components to
+    # evaluate, or None for all of them.
 
     # Read the partitions using the original features.
     df_en_train, df_en_test, df_es_train, df_es_test = models_shared.read_features()
 
-    # Read the partitions using the reduced features. This called function has an
-    # optional argument for specifying the number of PCs to read, but it's faster to
-    # read all PCs once and do the slicing later.
+    # Read the partitions using the reduced features. Reading all PCs once and slicing
+    # later is faster than reading a number of PCs at a time.
     (
         df_en_train_pca,
         df_en_test_pca,
@@ -76,58 +72,57 @@ def run_task_with_reduced_data(task: models_shared.Task, dir_output: Path):
         df_es_test_pca,
     ) = models_shared.read_features_pca(n_principal_components_max)
 
-    # The partitions for the original features versus PCA features should be identical
-    # already, but no harm in checking.
-    df_en_train.sort_index(inplace=True)
-    df_en_train_pca.sort_index(inplace=True)
+    # The PCA partitions are rotated from the original partitions, so their rows should
+    # be identical already, but no harm in checking.
     assert df_en_train.index.equals(df_en_train_pca.index)
-    df_en_test.sort_index(inplace=True)
-    df_en_test_pca.sort_index(inplace=True)
     assert df_en_test.index.equals(df_en_test_pca.index)
-    df_es_train.sort_index(inplace=True)
-    df_es_train_pca.sort_index(inplace=True)
     assert df_es_train.index.equals(df_es_train_pca.index)
-    df_es_test.sort_index(inplace=True)
-    df_es_test_pca.sort_index(inplace=True)
     assert df_es_test.index.equals(df_es_test_pca.index)
 
-    # To store scores for the different number of PCs.
-    n_principal_components_scores = np.empty(n_principal_components_max)
-
-    n_principal_components_range = range(
-        n_principal_components_min, n_principal_components_max + 1
+    run_task_with_reduced_data(
+        df_en_train_pca,
+        df_en_test_pca,
+        df_es_train,
+        df_es_test,
+        models_shared.Task.EN_TO_ES,
+        dir_output,
+    )
+    run_task_with_reduced_data(
+        df_es_train_pca,
+        df_es_test_pca,
+        df_en_train,
+        df_en_test,
+        models_shared.Task.ES_TO_EN,
+        dir_output,
     )
 
-    # Run the task with varying number of principal components.
-    for n_principal_components in n_principal_components_range:
-
-        if task is models_shared.Task.EN_TO_ES:
-            df_X_train = df_en_train_pca
-            df_X_test = df_en_test_pca
-            df_Y_train = df_es_train
-            df_Y_test = df_es_test
-        elif task is models_shared.Task.ES_TO_EN:
-            df_X_train = df_es_train_pca
-            df_X_test = df_es_test_pca
-            df_Y_train = df_en_train
-            df_Y_test = df_en_test
-        else:
-            print("Error")  # TODO Replace with proper error.
-
-        df_X_train = df_X_train.iloc[:, 0:n_principal_components]
-        df_X_test = df_X_test.iloc[:, 0:n_principal_components]
-
-        score_en_to_es_pca = run_task(
-            df_X_train,
-            df_X_test,
-            df_Y_train,
-            df_Y_test,
-            task,
-            dir_output=dir_output,
-            write_output=False,
-        )
-        n_principal_components_idx = n_principal_components - 1
-        n_principal_components_scores[n_principal_components_idx] = score_en_to_es_pca
+
+def run_task_with_reduced_data(
+    df_X_train: pd.DataFrame,
+    df_X_test: pd.DataFrame,
+    df_Y_train: pd.DataFrame,
+    df_Y_test: pd.DataFrame,
+    task: models_shared.Task,
+    dir_output: Path,
+):
+    # Increase the number of principal components, store results, and plot. Predict the
+    # original features from the first N principal components, i.e. use the reduced
+    # features as the predictors and the original features as the targets.
+
+    dir_output.mkdir(parents=True, exist_ok=True)  # TODO Duplicate code from dirs.py.
+    path_output_plot = dir_output.joinpath(f"plot-{task.name}.png")
+
+    print(f"Task: {task.name}")
+
+    # Run the task with every number of principal components at once.
+    n_principal_components_scores, _ = score_nested_predictors(
+        df_X_train.to_numpy(dtype=np.float64),
+        df_X_test.to_numpy(dtype=np.float64),
+        df_Y_train.to_numpy(dtype=np.float64),
+        df_Y_test.to_numpy(dtype=np.float64),
+    )
+    n_principal_components_max = n_principal_components_scores.shape[0]
+    n_principal_components_range = range(1, n_principal_components_max + 1)
 
     # Plot average error vs. number of principal components.
     # color_blue = "#45707A"  # gruvbox material light medium, blue
@@ -208,6 +203,55 @@ def run_task(
     return pred_average_error
 
 
+def score_nested_predictors(
+    X_train_arr: np.ndarray,
+    X_test_arr: np.ndarray,
+    Y_train_arr: np.ndarray,
+    Y_test_arr: np.ndarray,
+) -> Tuple[np.ndarray, np.ndarray]:
+    """Fit and score linear regression (with intercept) using the first p predictors,
+    for every p from 1 to the number of predictors, e.g. the first p principal
+    components.
+
+    The training predictors are factorized once with QR, A = QR, where A is the
+    predictors with a leading column of ones. The least squares coefficients for the
+    first p columns are R_p^-1 Q_p^T Y, with the leading p columns of Q and the leading
+    block of R. The leading block of the inverse of an upper triangular matrix is the
+    inverse of its leading block, so with C = Q^T Y, the coefficients for the first p
+    columns are the sum of the outer products R^-1[:, j] C[j] over j < p. The
+    coefficients and predictions of all prefixes are cumulative sums of the same terms.
+
+    Args:
+        X_train_arr (np.ndarray): Training predictors, shape (n_train, n_predictors),
+            ordered so that prefixes are meaningful (e.g. by variance explained).
+        X_test_arr (np.ndarray): Test predictors, shape (n_test, n_predictors).
+        Y_train_arr (np.ndarray): Training targets, shape (n_train, n_targets).
+        Y_test_arr (np.ndarray): Test targets, shape (n_test, n_targets).
+
+    Returns:
+        Tuple[np.ndarray, np.ndarray]: Scores (mean Euclidean distance of the test
+            predictions), where scores[p - 1] is the score using the first p
+            predictors, and coefficients of shape (n_predictors, n_predictors + 1,
+            n_targets), where coefficients[p - 1] has the intercept in its first row,
+            then the coefficients of the first p predictors, then zeros. They match
+            fitting LinearRegression on each prefix, up to float rounding.
+    """
+    A_train = np.column_stack((np.ones(X_train_arr.shape[0]), X_train_arr))
+    A_test = np.column_stack((np.ones(X_test_arr.shape[0]), X_test_arr))
+
+    Q, R = np.linalg.qr(A_train)
+    R_inv = solve_triangular(R, np.eye(R.shape[0]))
+    C = Q.T @ Y_train_arr
+
+    # Prefix 0 is the intercept only, and is dropped. Shapes: (n_predictors + 1,
+    # n_predictors + 1, n_targets) and (n_predictors + 1, n_test, n_targets).
+    coefficients = np.cumsum(R_inv.T[:, :, np.newaxis] * C[:, np.newaxis, :], axis=0)
+    W = A_test @ R_inv
+    Y_pred_prefixes = np.cumsum(W.T[:, :, np.newaxis] * C[:, np.newaxis, :], axis=0)
+    scores = metrics.euclidean_distance_2D(Y_pred_prefixes, Y_test_arr).mean(axis=1)
+    return scores[1:], coefficients[1:]
+
+
 def train(X_train_arr, Y_train_arr) -> LinearRegression:
     regressor = LinearRegression()
     regressor.fit(X_train_arr, Y_train_arr)
@@ -8,8 +8,8 @@ import pandas as pd
 
 def main():
     df_en_train, df_en_test, df_es_train, df_es_test = models_shared.read_features()
-    run_task(df_es_test, models_shared.Task.en_to_es)
-    run_task(df_en_test, models_shared.Task.es_to_en)
+    run_task(df_es_test, models_shared.Task.EN_TO_ES)
+    run_task(df_en_test, models_shared.Task.ES_TO_EN)
 
 
 def run_task(Y_test_df: pd.DataFrame, task: models_shared.Task) -> np.float64:
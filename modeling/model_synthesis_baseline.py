@@ -1,16 +1,22 @@
 # The synthesis baseline model estimates the translation of a fragment prosody
 # representation by: transcribing the fragment's translation, synthesizing speech from
 # the transcription, then computing its prosody representation.
-# 
+#
 # Computing prosody representations at this point would require calling MATLAB code, so
 # instead, the transcription, synthesis, and feature computation is done before calling
 # this function, as part of the data workflow (see ../DRAL/README.md), hence the input
 # argument `Y_test_synth_df`.
+import data
+import metrics
+import models_shared
+import numpy as np
 import pandas as pd
 
 
 def test_synthesis_baseline(
-    Y_test_df: pd.DataFrame, Y_test_synth_df: pd.DataFrame, test_type: TestType
+    Y_test_df: pd.DataFrame,
+    Y_test_synth_df: pd.DataFrame,
+    test_type: models_shared.Task,
 ) -> np.float64:
 
     Y_test_arr = Y_test_df.to_numpy()
@@ -21,10 +27,10 @@ def test_synthesis_baseline(
     # TODO Borrowed from ../DRAL/utils/dirs.py.
     data.DIR_SYNTH_BASELINE_OUTPUT.mkdir(parents=True, exist_ok=True)
 
-    if test_type == TestType.en_to_es:
+    if test_type == models_shared.Task.EN_TO_ES:
         path_output_Y_test = data.PATH_SYNTH_BASELINE_FEATS_TEST_EN_ES
         path_output_Y_pred = data.PATH_SYNTH_BASELINE_FEATS_PRED_EN_ES
-    elif test_type == TestType.es_to_en:
+    elif test_type == models_shared.Task.ES_TO_EN:
         path_output_Y_test = data.PATH_SYNTH_BASELINE_FEATS_TEST_ES_EN
         path_output_Y_pred = data.PATH_SYNTH_BASELINE_FEATS_PRED_ES_EN
     else:
@@ -1,8 +1,12 @@
 from enum import Enum, auto
 from pathlib import Path
-from typing import Tuple
+from typing import Iterator, List, Optional, Tuple
 
+import numpy as np
 import pandas as pd
+from feature_store import read_store, take_rows_df
+from pairs import pair_rows, read_pair_index
+from pca import fit_pca, rotate
 from sklearn.preprocessing import StandardScaler
 
 
@@ -11,35 +15,45 @@ class Task(Enum):
     ES_TO_EN = auto()
 
 
-def read_features() -> Tuple[pd.DataFrame, pd.DataFrame, pd.DataFrame, pd.DataFrame]:
-    # Read features computed with MATLAB.
+DIR_RELEASE = Path("/Users/jon/Documents/dissertation/DRAL-corpus/release/")
+PATH_FEATURES = DIR_RELEASE.joinpath("features/features.csv")
+PATH_METADATA_SHORT = DIR_RELEASE.joinpath("fragments-short.csv")
+DIR_PCA_CACHE = DIR_RELEASE.joinpath("features/PCA-cache")
 
-    path_features = (
-        "/Users/jon/Documents/dissertation/DRAL-corpus/release/features/features.csv"
-    )
-    df_features = pd.read_csv(path_features, index_col="Row")
+
+def read_features(
+    base_codes: Optional[List[str]] = None, spans: Optional[List[str]] = None
+) -> Tuple[pd.DataFrame, pd.DataFrame, pd.DataFrame, pd.DataFrame]:
+    # Read features computed with MATLAB. Optionally read only the features with some
+    # base codes or spans, e.g. `base_codes=["tl", "th"]`.
+
+    values, frag_ids, columns = read_store(PATH_FEATURES, "Row", base_codes, spans)
 
     # path_idx_train = dir_release.joinpath("idx_test.csv")
     # path_idx_test = dir_release.joinpath("idx_test.csv")
 
     # TODO Temporary fix: Read the split DataFrames instead. In the future, only the IDs
     # will be stored in the CSVs. These are DataFrames with metadata.
-    dir_release = Path("/Users/jon/Documents/dissertation/DRAL-corpus/release/")
+    dir_release = DIR_RELEASE
     df_en_train = pd.read_csv(
         dir_release.joinpath("features/EN-train.csv"),
         index_col="id",
+        usecols=["id"],
     )
     df_en_test = pd.read_csv(
         dir_release.joinpath("features/EN-test.csv"),
         index_col="id",
+        usecols=["id"],
     )
     df_es_train = pd.read_csv(
         dir_release.joinpath("features/ES-train.csv"),
         index_col="id",
+        usecols=["id"],
     )
     df_es_test = pd.read_csv(
         dir_release.joinpath("features/ES-test.csv"),
         index_col="id",
+        usecols=["id"],
     )
     # Read the index (IDs) from them.
 
@@ -49,12 +63,24 @@ def read_features() -> Tuple[pd.DataFrame, pd.DataFrame, pd.DataFrame, pd.DataFr
     # df_en = pd.read_csv(path_features_en)
     # df_es = pd.read_csv(path_features_es)
 
-    # TODO Some fragments were dropped since the Interspeech data, so temporarily ignore
-    # these.
-    df_en_train = df_features.loc[df_en_train.index.intersection(df_features.index)]
-    df_en_test = df_features.loc[df_en_test.index.intersection(df_features.index)]
-    df_es_train = df_features.loc[df_es_train.index.intersection(df_features.index)]
-    df_es_test = df_features.loc[df_es_test.index.intersection(df_features.index)]
+    # Align the rows of each EN fragment and its ES translation. Pairs without features
+    # are left out, since some fragments were dropped since the Interspeech data.
+    rows_en, rows_es = pair_rows(frag_ids, read_pair_index(PATH_METADATA_SHORT))
+    frag_ids_en = frag_ids[rows_en]
+    frag_ids_es = frag_ids[rows_es]
+
+    # A pair is in a partition if both of its fragments are.
+    is_train = pd.Index(frag_ids_en).isin(df_en_train.index) & pd.Index(
+        frag_ids_es
+    ).isin(df_es_train.index)
+    is_test = pd.Index(frag_ids_en).isin(df_en_test.index) & pd.Index(frag_ids_es).isin(
+        df_es_test.index
+    )
+
+    df_en_train = take_rows_df(values, frag_ids, columns, rows_en[is_train])
+    df_en_test = take_rows_df(values, frag_ids, columns, rows_en[is_test])
+    df_es_train = take_rows_df(values, frag_ids, columns, rows_es[is_train])
+    df_es_test = take_rows_df(values, frag_ids, columns, rows_es[is_test])
 
     df_en_train_norm, df_en_test_norm = standardize_features(df_en_train, df_en_test)
     df_es_train_norm, df_es_test_norm = standardize_features(df_es_train, df_es_test)
@@ -62,45 +88,77 @@ def read_features() -> Tuple[pd.DataFrame, pd.DataFrame, pd.DataFrame, pd.DataFr
     return df_en_train_norm, df_en_test_norm, df_es_train_norm, df_es_test_norm
 
 
-def read_features_pca(n_principal_components: int = 8):
-    # Input arguments:
-    #   n_principal_components - the number of principal components to use, return when
-    #   reading the rotated data (columns or principal components are already ordered by
-    #   variance explained)
-    # Read features computed with MATLAB (PCA workflow).
+def read_features_folds(
+    n_folds: int = 5,
+    base_codes: Optional[List[str]] = None,
+    spans: Optional[List[str]] = None,
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    # Read features computed with MATLAB and the K speaker-independent folds written by
+    # create_partitions.py (`--n_folds`). Returns the EN and ES features as aligned
+    # arrays (row i of each is a translation pair), the fold of each row, and the
+    # feature names. The features are not standardized, since the scaler must be fit on
+    # each fold's training rows; see iter_folds. Optionally read only the features with
+    # some base codes or spans, as in read_features.
 
-    dir_pca_output = Path(
-        "/Users/jon/Documents/dissertation/DRAL-corpus/release/features"
-    )
-    path_features_en_train = dir_pca_output.joinpath(
-        "PCA-outputs-EN/rotated-train-EN.csv"
-    )
-    path_features_en_test = dir_pca_output.joinpath(
-        "PCA-outputs-EN/rotated-test-EN.csv"
-    )
-    path_features_es_train = dir_pca_output.joinpath(
-        "PCA-outputs-ES/rotated-train-ES.csv"
-    )
-    path_features_es_test = dir_pca_output.joinpath(
-        "PCA-outputs-ES/rotated-test-ES.csv"
-    )
+    values, frag_ids, columns = read_store(PATH_FEATURES, "Row", base_codes, spans)
 
-    # The MATLAB code reads the partitions and outputs separate files, so no need to split again here.
-    # The columns (PCs) are ordered by variance.
-    df_en_train = pd.read_csv(path_features_en_train, index_col="Row")
-    df_en_test = pd.read_csv(path_features_en_test, index_col="Row")
-    df_es_train = pd.read_csv(path_features_es_train, index_col="Row")
-    df_es_test = pd.read_csv(path_features_es_test, index_col="Row")
+    with np.load(DIR_RELEASE.joinpath(f"features/folds-{n_folds}.npz")) as folds_file:
+        frag_ids_en = folds_file["frag_ids_EN"]
+        frag_ids_es = folds_file["frag_ids_ES"]
+        folds = folds_file["folds"]
 
-    print(f"Number of principal components read: {n_principal_components}")
-    df_en_train = df_en_train.iloc[:, 0:n_principal_components]
-    df_en_test = df_en_test.iloc[:, 0:n_principal_components]
-    df_es_train = df_es_train.iloc[:, 0:n_principal_components]
-    df_es_test = df_es_test.iloc[:, 0:n_principal_components]
+    # TODO Some fragments were dropped since the Interspeech data, so temporarily ignore
+    # pairs without features.
+    index = pd.Index(frag_ids)
+    rows_en = index.get_indexer(frag_ids_en)
+    rows_es = index.get_indexer(frag_ids_es)
+    is_pair_present = (rows_en >= 0) & (rows_es >= 0)
+    arr_en = values[rows_en[is_pair_present]]
+    arr_es = values[rows_es[is_pair_present]]
 
-    # TODO Is the standardization step needed?
+    return arr_en, arr_es, folds[is_pair_present], columns
 
-    return df_en_train, df_en_test, df_es_train, df_es_test
+
+def iter_folds(folds: np.ndarray) -> Iterator[Tuple[np.ndarray, np.ndarray]]:
+    # Yield the training and test row indices of each fold, for slicing the arrays
+    # returned by read_features_folds. Standardize with standardize_features, e.g.:
+    #   for idx_train, idx_test in iter_folds(folds):
+    #       X_train, X_test = standardize_features(X[idx_train], X[idx_test])
+    for fold in np.unique(folds):
+        yield np.flatnonzero(folds != fold), np.flatnonzero(folds == fold)
+
+
+def read_features_pca(
+    n_principal_components: int = 8, svd_solver: str = "full"
+) -> Tuple[pd.DataFrame, pd.DataFrame, pd.DataFrame, pd.DataFrame]:
+    # Input arguments:
+    #   n_principal_components - the number of principal components to return (columns
+    #   or principal components are ordered by variance explained)
+    #   svd_solver - "full" or "randomized", see pca.fit_pca
+    # Read the standardized partitions of read_features and rotate them with PCA fit on
+    # each language's training partition. Fits are cached in DIR_PCA_CACHE.
+
+    df_en_train, df_en_test, df_es_train, df_es_test = read_features()
+
+    print(f"Number of principal components read: {n_principal_components}")
+    dfs_pca = []
+    for df_train, df_test in [(df_en_train, df_en_test), (df_es_train, df_es_test)]:
+        pca_fit = fit_pca(
+            df_train.to_numpy(),
+            n_principal_components,
+            svd_solver,
+            dir_cache=DIR_PCA_CACHE,
+        )
+        pc_names = [f"PC{i + 1}" for i in range(pca_fit["components"].shape[0])]
+        for df in [df_train, df_test]:
+            dfs_pca.append(
+                pd.DataFrame(
+                    rotate(df.to_numpy(), pca_fit), index=df.index, columns=pc_names
+                )
+            )
+
+    df_en_train_pca, df_en_test_pca, df_es_train_pca, df_es_test_pca = dfs_pca
+    return df_en_train_pca, df_en_test_pca, df_es_train_pca, df_es_test_pca
 
 
 def standardize_features(
@@ -117,6 +175,10 @@ def standardize_features(
     arr_train_norm = scaler.fit_transform(df_train)
     arr_test_norm = scaler.transform(df_test)
 
+    # Arrays are returned as arrays, e.g. the folds of read_features_folds().
+    if not isinstance(df_train, pd.DataFrame):
+        return arr_train_norm, arr_test_norm
+
     # Convert from NumPy arrays back to pandas DataFrames.
     column_labels = df_train.columns
     df_train_norm = pd.DataFrame(
@@ -1,8 +1,14 @@
+import copy
+import csv
+import os
 import random
+import time
+from pathlib import Path
+from typing import Optional
 
 import numpy as np
 import torch
-from torch.utils.data import DataLoader
+from torch.utils.data import BatchSampler, DataLoader, SequentialSampler
 from torch.utils.data.dataset import Dataset
 from torch import nn
 from torchinfo import summary
@@ -16,23 +22,35 @@ import metrics
 #   - https://pytorch.org/tutorials/beginner/basics/quickstart_tutorial.html
 #   - Early stopping: https://clay-atlas.com/us/blog/2021/08/25/pytorch-en-early-stopping/
 
+# Columns of the per-epoch log of test_neural_network. The validation loss decides when
+# to stop; seconds is the time to train and validate one epoch.
+LOG_COLUMNS = ["epoch", "seconds", "train_loss", "val_loss", "test_loss"]
+
 
 class DRALdataset(Dataset):
-    def __init__(self, X, Y):
-        self.X = X
-        self.Y = Y
+    # Predictors and targets (DataFrames or arrays), converted once to contiguous
+    # float32 tensors on the device. Index with a list of row indices to get a whole
+    # batch with one slice; see make_dataloader.
+    def __init__(self, X, Y, device: str = "cpu"):
+        self.X = torch.as_tensor(np.asarray(X, dtype=np.float32), device=device)
+        self.Y = torch.as_tensor(np.asarray(Y, dtype=np.float32), device=device)
 
-    def __getitem__(self, index: int):
-        x_df = self.X.iloc[index]
-        y_df = self.Y.iloc[index]
-        x_arr = x_df.to_numpy()
-        y_arr = y_df.to_numpy()
-        return x_arr, y_arr
+    def __getitem__(self, index):
+        return self.X[index], self.Y[index]
 
     def __len__(self):
         return self.X.shape[0]
 
 
+def make_dataloader(dataset: DRALdataset, batch_size: int) -> DataLoader:
+    # Serve batches in order by indexing the dataset once per batch, rather than once
+    # per row and then collating the rows.
+    batch_sampler = BatchSampler(
+        SequentialSampler(dataset), batch_size=batch_size, drop_last=False
+    )
+    return DataLoader(dataset, sampler=batch_sampler, batch_size=None)
+
+
 class NeuralNetwork(nn.Module):
     def __init__(self):
         super(NeuralNetwork, self).__init__()
@@ -45,13 +63,16 @@ class NeuralNetwork(nn.Module):
         )
 
     def forward(self, x):
-        x = x.to(torch.float32)
         x_out = self.linear_sigmoid_stack(x)
         return x_out
 
 
-def train(dataloader, model, loss_fn, optimizer, device):
+def train(dataloader, model, loss_fn, optimizer, device) -> float:
+    # Train for one epoch and return the average training loss of its batches.
+    num_batches = len(dataloader)
     model.train()
+    train_loss = 0
+
     for batch, (X, Y) in enumerate(dataloader):
         X, Y = X.to(device), Y.to(device)
         Y_pred = model(X)
@@ -59,9 +80,13 @@ def train(dataloader, model, loss_fn, optimizer, device):
         optimizer.zero_grad()
         loss.backward()
         optimizer.step()
+        train_loss += loss.item()
+
+    train_loss /= num_batches
+    return train_loss
 
 
-def test(dataloader, model, loss_fn, device):
+def test(dataloader, model, loss_fn, device) -> float:
 
     num_batches = len(dataloader)
     model.eval()
@@ -74,11 +99,59 @@ def test(dataloader, model, loss_fn, device):
             test_loss += loss_fn(pred, y).item()
 
     test_loss /= num_batches
-    print(f"\tAverage loss: {test_loss:>8f}")
     return test_loss
 
 
-def test_neural_network(X_train_df, X_test_df, Y_train_df, Y_test_df):
+def predict(model, X_arr: np.ndarray) -> np.ndarray:
+    # Predict the targets of an array of predictors with a trained model.
+    device = next(model.parameters()).device
+    model.eval()
+    with torch.no_grad():
+        Y_pred = model(torch.as_tensor(X_arr, dtype=torch.float32, device=device))
+    return Y_pred.cpu().numpy()
+
+
+def test_neural_network(
+    X_train_df,
+    X_test_df,
+    Y_train_df,
+    Y_test_df,
+    max_epochs: int = 500,
+    patience: int = 20,
+    validation_fraction: float = 0.1,
+    path_checkpoint: Optional[Path] = None,
+    checkpoint_every: int = 10,
+    path_log: Optional[Path] = None,
+):
+    """Train a model, stopping early once the validation loss stops improving.
+
+    The validation rows are a random `validation_fraction` of the training rows, held
+    out from training. Training stops after `patience` epochs without a lower
+    validation loss, and the model is restored to its best epoch. The test data is
+    scored after each epoch only if `path_log` is given, and once at the end.
+
+    Args:
+        X_train_df (pd.DataFrame): Training predictors.
+        X_test_df (pd.DataFrame): Test predictors.
+        Y_train_df (pd.DataFrame): Training targets.
+        Y_test_df (pd.DataFrame): Test targets.
+        max_epochs (int, optional): Maximum number of epochs. Defaults to 500.
+        patience (int, optional): Number of epochs without improvement of the
+            validation loss before stopping. Defaults to 20.
+        validation_fraction (float, optional): Fraction of the training rows to hold out
+            for validation. Defaults to 0.1.
+        path_checkpoint (Optional[Path], optional): Checkpoint file. If it exists,
+            training resumes from it. It is written every `checkpoint_every` epochs and
+            when training stops. Defaults to None, no checkpoints.
+        checkpoint_every (int, optional): Number of epochs between checkpoints.
+            Defaults to 10.
+        path_log (Optional[Path], optional): CSV file to append a row to after each
+            epoch, with its time in seconds and its losses, including the test loss.
+            Defaults to None, no log, and no scoring of the test data per epoch.
+
+    Returns:
+        tuple[float, NeuralNetwork]: The test loss of the best model, and the model.
+    """
     device = "cuda" if torch.cuda.is_available() else "cpu"
     print(f"Using {device} device")
 
@@ -87,13 +160,6 @@ def test_neural_network(X_train_df, X_test_df, Y_train_df, Y_test_df):
     torch.manual_seed(consts.RANDOM_STATE_VAL)
     random.seed(consts.RANDOM_STATE_VAL)
     np.random.seed(consts.RANDOM_STATE_VAL)
-    g = torch.Generator()
-    g.manual_seed(consts.RANDOM_STATE_VAL)
-
-    def seed_worker(worker_id):
-        worker_seed = torch.initial_seed() % 2**32
-        np.random.seed(worker_seed)
-        random.seed(worker_seed)
 
     model = NeuralNetwork().to(device)
     batch_size = 32
@@ -101,27 +167,97 @@ def test_neural_network(X_train_df, X_test_df, Y_train_df, Y_test_df):
     summary(model)
     print(f"{batch_size = }")
 
-    train_data = DRALdataset(X_train_df, Y_train_df)
-    test_data = DRALdataset(X_test_df, Y_test_df)
+    # Hold out validation rows from the training rows.
+    X_train_arr = np.asarray(X_train_df, dtype=np.float32)
+    Y_train_arr = np.asarray(Y_train_df, dtype=np.float32)
+    rng = np.random.default_rng(consts.RANDOM_STATE_VAL)
+    rows = rng.permutation(X_train_arr.shape[0])
+    n_val = max(1, round(validation_fraction * rows.shape[0]))
+    rows_val, rows_train = np.sort(rows[:n_val]), np.sort(rows[n_val:])
 
-    train_dataloader = DataLoader(
-        train_data, batch_size=batch_size, worker_init_fn=seed_worker, generator=g
-    )
-    test_dataloader = DataLoader(
-        test_data, batch_size=batch_size, worker_init_fn=seed_worker, generator=g
-    )
+    train_data = DRALdataset(X_train_arr[rows_train], Y_train_arr[rows_train], device)
+    val_data = DRALdataset(X_train_arr[rows_val], Y_train_arr[rows_val], device)
+    test_data = DRALdataset(X_test_df, Y_test_df, device)
+
+    train_dataloader = make_dataloader(train_data, batch_size)
+    val_dataloader = make_dataloader(val_data, batch_size)
+    test_dataloader = make_dataloader(test_data, batch_size)
 
-    loss_fn = metrics.mean_euclidean_distance_tensor
+    loss_fn = metrics.mean_euclidean_distance
     learning_rate = 1e-3
     optimizer = torch.optim.SGD(model.parameters(), lr=learning_rate)
 
-    # TODO Add early stopping.
+    state = {
+        "epoch": 0,
+        "best_epoch": 0,
+        "best_val_loss": float("inf"),
+        "best_model_state": copy.deepcopy(model.state_dict()),
+    }
+    if path_checkpoint is not None and Path(path_checkpoint).exists():
+        checkpoint = torch.load(path_checkpoint, map_location=device)
+        model.load_state_dict(checkpoint["model_state"])
+        optimizer.load_state_dict(checkpoint["optimizer_state"])
+        state = checkpoint["state"]
+        print(f"Resuming from epoch {state['epoch']}: {path_checkpoint}")
 
-    epochs = 50
-    test_loss = 0
-    for epoch_num in range(epochs):
-        print(f"Epoch {epoch_num+1}, ", end="")
-        train(train_dataloader, model, loss_fn, optimizer, device)
-        test_loss = test(test_dataloader, model, loss_fn, device)
+    if path_log is not None:
+        # Start a new log, or drop the epochs logged after the checkpoint resumed from.
+        log_rows = []
+        if state["epoch"] > 0 and Path(path_log).exists():
+            with open(path_log, newline="") as log_file:
+                log_rows = list(csv.reader(log_file))[1:]
+        with open(path_log, "w", newline="") as log_file:
+            writer = csv.writer(log_file)
+            writer.writerow(LOG_COLUMNS)
+            writer.writerows(row for row in log_rows if int(row[0]) <= state["epoch"])
 
-    return test_loss
+    def save_checkpoint():
+        # Write to a temporary file, then rename it onto the checkpoint, so an interrupt
+        # during the save leaves the previous checkpoint intact.
+        path_checkpoint_tmp = Path(path_checkpoint).with_suffix(".tmp")
+        torch.save(
+            {
+                "model_state": model.state_dict(),
+                "optimizer_state": optimizer.state_dict(),
+                "state": state,
+            },
+            path_checkpoint_tmp,
+        )
+        os.replace(path_checkpoint_tmp, path_checkpoint)
+
+    for epoch_num in range(state["epoch"] + 1, max_epochs + 1):
+        if epoch_num - state["best_epoch"] > patience:
+            break
+
+        time_start = time.perf_counter()
+        train_loss = train(train_dataloader, model, loss_fn, optimizer, device)
+        val_loss = test(val_dataloader, model, loss_fn, device)
+        seconds = time.perf_counter() - time_start
+        print(
+            f"Epoch {epoch_num}, train loss: {train_loss:>8f}, validation loss: "
+            f"{val_loss:>8f}, {seconds:.2f} s"
+        )
+
+        state["epoch"] = epoch_num
+        if val_loss < state["best_val_loss"]:
+            state["best_epoch"] = epoch_num
+            state["best_val_loss"] = val_loss
+            state["best_model_state"] = copy.deepcopy(model.state_dict())
+
+        # The test data is only scored for the log.
+        if path_log is not None:
+            test_loss = test(test_dataloader, model, loss_fn, device)
+            with open(path_log, "a", newline="") as log_file:
+                csv.writer(log_file).writerow(
+                    [epoch_num, seconds, train_loss, val_loss, test_loss]
+                )
+        if path_checkpoint is not None and epoch_num % checkpoint_every == 0:
+            save_checkpoint()
+
+    if path_checkpoint is not None:
+        save_checkpoint()
+
+    print(f"Best epoch: {state['best_epoch']} of {state['epoch']}")
+    model.load_state_dict(state["best_model_state"])
+    test_loss = test(test_dataloader, model, loss_fn, device)
+    return test_loss, model
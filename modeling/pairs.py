@@ -0,0 +1,82 @@
+# Index of translation pairs, built from the `trans_id` column of the release metadata,
+# for aligning the feature rows of fragments with the rows of their translations by
+# integer position, e.g.:
+#
+#   df_pairs = read_pair_index(path_metadata)
+#   rows_en, rows_es = pair_rows(frag_ids, df_pairs, "EN", "ES")
+#   arr_en, arr_es = values[rows_en], values[rows_es]  # Row i of each is a pair.
+
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+
+def read_pair_index(path_metadata: Path) -> pd.DataFrame:
+    """Read the language and translation of every fragment from release metadata, e.g.
+    fragments-short.csv, and check that translations are mutual.
+
+    Args:
+        path_metadata (Path): Path to fragment metadata with the columns "id",
+            "lang_code", and "trans_id".
+
+    Raises:
+        ValueError: If a fragment's translation has a different translation.
+
+    Returns:
+        pd.DataFrame: The columns "lang_code" and "trans_id", indexed by fragment ID.
+    """
+    df_pairs = pd.read_csv(
+        path_metadata, index_col="id", usecols=["id", "lang_code", "trans_id"]
+    )
+
+    # A fragment's translation must have the fragment as its translation, when the
+    # translation is in the metadata.
+    trans_of_trans = df_pairs["trans_id"].reindex(df_pairs["trans_id"]).to_numpy()
+    has_trans = pd.notna(trans_of_trans)
+    is_mismatch = has_trans & (trans_of_trans != df_pairs.index.to_numpy())
+    if is_mismatch.any():
+        raise ValueError(
+            "Translations are not mutual for fragments: "
+            f"{list(df_pairs.index[is_mismatch])}"
+        )
+
+    return df_pairs
+
+
+def pair_rows(
+    frag_ids: np.ndarray,
+    df_pairs: pd.DataFrame,
+    lang_code_from: str = "EN",
+    lang_code_to: str = "ES",
+) -> tuple[np.ndarray, np.ndarray]:
+    """Find the rows of fragments in one language and the rows of their translations in
+    another language, among the rows of a feature table.
+
+    Args:
+        frag_ids (np.ndarray): Fragment ID of each row of a feature table.
+        df_pairs (pd.DataFrame): Pair index, from read_pair_index.
+        lang_code_from (str, optional): Language of the fragments. Defaults to "EN".
+        lang_code_to (str, optional): Language of the translations. Defaults to "ES".
+
+    Returns:
+        tuple[np.ndarray, np.ndarray]: The rows of the fragments, in the order of
+            `frag_ids`, and the rows of their translations. Pairs with either fragment
+            missing from `frag_ids` are left out.
+    """
+    index = pd.Index(frag_ids)
+    rows_from = index.get_indexer(df_pairs.index)
+    rows_to = index.get_indexer(df_pairs["trans_id"])
+    lang_code_trans = df_pairs["lang_code"].reindex(df_pairs["trans_id"]).to_numpy()
+
+    is_pair = (
+        (df_pairs["lang_code"].to_numpy() == lang_code_from)
+        & (lang_code_trans == lang_code_to)
+        & (rows_from >= 0)
+        & (rows_to >= 0)
+    )
+    rows_from = rows_from[is_pair]
+    rows_to = rows_to[is_pair]
+
+    order = np.argsort(rows_from)
+    return rows_from[order], rows_to[order]
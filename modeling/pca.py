@@ -0,0 +1,73 @@
+# Principal component analysis of features, fit on a training partition, replacing the
+# MATLAB PCA workflow (runPCAfunctions.m) that wrote rotated-train-*.csv and
+# rotated-test-*.csv. The components and variance explained are cached on disk, keyed
+# by the training data, so changing the partitions or features only refits what changed.
+
+import hashlib
+from pathlib import Path
+from typing import Optional
+
+import consts
+import numpy as np
+from sklearn.decomposition import PCA
+
+
+def fit_pca(
+    X_train: np.ndarray,
+    n_components: Optional[int] = None,
+    svd_solver: str = "full",
+    dir_cache: Optional[Path] = None,
+) -> dict:
+    """Fit PCA on training features, or read the fit from the cache.
+
+    Args:
+        X_train (np.ndarray): Training features, shape (n_frags, n_features), e.g.
+            standardized with models_shared.standardize_features.
+        n_components (Optional[int], optional): Number of principal components to keep.
+            Defaults to None, all components.
+        svd_solver (str, optional): "full" for an exact SVD, or "randomized" for a
+            faster approximate SVD of the first `n_components`. Defaults to "full".
+        dir_cache (Optional[Path], optional): Directory to cache fits in. Defaults to
+            None, no caching.
+
+    Returns:
+        dict: "mean" of the training features, "components" with shape (n_components,
+            n_features) ordered by variance explained, and "variance_explained", the
+            ratio of variance explained by each component.
+    """
+    n_components_max = min(X_train.shape)
+    if n_components is None or n_components > n_components_max:
+        n_components = n_components_max
+
+    path_cache = None
+    if dir_cache is not None:
+        key = hashlib.sha1(np.ascontiguousarray(X_train).tobytes())
+        key.update(f"{X_train.shape}-{n_components}-{svd_solver}".encode())
+        path_cache = Path(dir_cache).joinpath(f"pca-{key.hexdigest()}.npz")
+        if path_cache.exists():
+            with np.load(path_cache) as cache_file:
+                return dict(cache_file)
+
+    pca = PCA(
+        n_components=n_components,
+        svd_solver=svd_solver,
+        random_state=consts.RANDOM_STATE_VAL,
+    )
+    pca.fit(X_train)
+    pca_fit = {
+        "mean": pca.mean_,
+        "components": pca.components_,
+        "variance_explained": pca.explained_variance_ratio_,
+    }
+
+    if path_cache is not None:
+        path_cache.parent.mkdir(parents=True, exist_ok=True)
+        np.savez(path_cache, **pca_fit)
+
+    return pca_fit
+
+
+def rotate(X: np.ndarray, pca_fit: dict) -> np.ndarray:
+    # Project features onto the principal components of a fit from fit_pca. Column i of
+    # the result is principal component i + 1.
+    return (X - pca_fit["mean"]) @ pca_fit["components"].T
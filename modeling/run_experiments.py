@@ -0,0 +1,278 @@
+# Run every (model, task, fold) combination in a process pool and write the results to
+# disk.
+#
+# The aligned EN and ES feature arrays of read_features_folds are loaded once and put in
+# shared memory, so workers read them without copies or reloading. Each job standardizes
+# its fold, fits a model, and predicts the fold's test rows. The output directory gets:
+#   results.csv      one row per job: model, task, fold, score, fit and predict times
+#                    in seconds, and the numbers of training and test rows
+#   predictions.npz  per model and task, the out-of-fold predictions of every row
+#                    (`<model>-<task>`), and the fold of every row (`folds`)
+#
+# Models fit and are scored on features standardized with each fold's training rows, but
+# the predictions are written in the original feature units, so rows predicted in
+# different folds are comparable.
+#
+# Rows follow the order of models_shared.read_features_folds.
+
+import argparse
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+from pathlib import Path
+from typing import Callable
+
+import metrics
+import model_knn
+import model_linear_regression
+import models_shared
+import neural_network
+import numpy as np
+import pandas as pd
+import torch
+from sklearn.preprocessing import StandardScaler
+from threadpoolctl import threadpool_limits
+
+
+def fit_naive_baseline(X_train, Y_train, X_test, Y_test):
+    return None
+
+
+def predict_naive_baseline(model, X_test):
+    # Keep prosody the same in translation.
+    return X_test
+
+
+def fit_knn(X_train, Y_train, X_test, Y_test):
+    return X_train, Y_train
+
+
+def predict_knn(model, X_test, n_neighbors: int = 5):
+    X_train, Y_train = model
+    return model_knn.predict_k_sweep(X_train, Y_train, X_test, n_neighbors)[-1]
+
+
+def fit_neural_network(X_train, Y_train, X_test, Y_test):
+    # Without a log, the test data is only scored once, for the returned loss, which the
+    # harness recomputes from the predictions.
+    _, model = neural_network.test_neural_network(
+        pd.DataFrame(X_train),
+        pd.DataFrame(X_test),
+        pd.DataFrame(Y_train),
+        pd.DataFrame(Y_test),
+    )
+    return model
+
+
+def fit_linear_regression(X_train, Y_train, X_test, Y_test):
+    return model_linear_regression.train(X_train, Y_train)
+
+
+# Each model is a pair of functions, timed separately: fit(X_train, Y_train, X_test,
+# Y_test) returns a fitted model, and predict(model, X_test) returns the predictions.
+MODELS: dict[str, tuple[Callable, Callable]] = {
+    "naive_baseline": (fit_naive_baseline, predict_naive_baseline),
+    "linear_regression": (fit_linear_regression, model_linear_regression.predict),
+    "knn": (fit_knn, predict_knn),
+    "neural_network": (fit_neural_network, neural_network.predict),
+}
+
+RESULTS_COLUMNS = [
+    "model",
+    "task",
+    "fold",
+    "score",
+    "seconds_fit",
+    "seconds_predict",
+    "n_train",
+    "n_test",
+]
+
+# Feature arrays in shared memory, attached by each worker in _init_worker.
+_worker_shms = []
+_worker_arrays = {}
+
+
+def main():
+    dir_this_file = Path(__file__).parent.resolve()
+
+    parser = argparse.ArgumentParser(
+        description="Run every (model, task, fold) combination in parallel and write "
+        "the scores, times, and predictions to disk.",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+    )
+    parser.add_argument(
+        "-o",
+        "--dir_output",
+        help="Output directory.",
+        default=dir_this_file.joinpath("experiments-outputs"),
+    )
+    parser.add_argument(
+        "-k",
+        "--n_folds",
+        help="Number of folds, as written by create_partitions.py --n_folds.",
+        type=int,
+        default=5,
+    )
+    parser.add_argument(
+        "-m",
+        "--models",
+        help="Models to run.",
+        nargs="+",
+        choices=list(MODELS.keys()),
+        default=list(MODELS.keys()),
+    )
+    parser.add_argument(
+        "--n_workers",
+        help="Number of worker processes.",
+        type=int,
+        default=os.cpu_count(),
+    )
+    args = parser.parse_args()
+
+    dir_output = Path(args.dir_output)
+    dir_output.mkdir(parents=True, exist_ok=True)
+
+    arr_en, arr_es, folds, _ = models_shared.read_features_folds(args.n_folds)
+    df_results, predictions = run_experiments(
+        {"EN": arr_en, "ES": arr_es}, folds, args.models, args.n_workers
+    )
+
+    path_results = dir_output.joinpath("results.csv")
+    df_results.to_csv(path_results, index=False)
+    print(f"Results written to: {path_results}")
+    path_predictions = dir_output.joinpath("predictions.npz")
+    np.savez(path_predictions, folds=folds, **predictions)
+    print(f"Predictions written to: {path_predictions}")
+
+    print(
+        df_results.groupby(["model", "task"])[
+            ["score", "seconds_fit", "seconds_predict"]
+        ]
+        .mean()
+        .to_string()
+    )
+
+
+def run_experiments(
+    arrays: dict[str, np.ndarray],
+    folds: np.ndarray,
+    model_names: list[str],
+    n_workers: int,
+) -> tuple[pd.DataFrame, dict[str, np.ndarray]]:
+    """Run every combination of model, task, and fold in a process pool.
+
+    Args:
+        arrays (dict[str, np.ndarray]): Aligned feature arrays by language code ("EN"
+            and "ES"); row i of each is a translation pair.
+        folds (np.ndarray): Fold of each row.
+        model_names (list[str]): Names of models in MODELS.
+        n_workers (int): Number of worker processes.
+
+    Returns:
+        tuple[pd.DataFrame, dict[str, np.ndarray]]: The results, with the columns of
+            RESULTS_COLUMNS, and the out-of-fold predictions of every row, in the
+            original feature units, by "<model>-<task>".
+    """
+    # Copy the arrays into shared memory once. Workers attach to them by name.
+    shms = []
+    specs = {}
+    try:
+        for lang_code, arr in arrays.items():
+            arr = np.ascontiguousarray(arr)
+            shm = shared_memory.SharedMemory(create=True, size=arr.nbytes)
+            shms.append(shm)
+            np.ndarray(arr.shape, arr.dtype, buffer=shm.buf)[:] = arr
+            specs[lang_code] = (shm.name, arr.shape, arr.dtype.str)
+
+        jobs = [
+            (model_name, task, idx_train, idx_test, fold)
+            for model_name in model_names
+            for task in models_shared.Task
+            for fold, (idx_train, idx_test) in zip(
+                np.unique(folds), models_shared.iter_folds(folds)
+            )
+        ]
+        # The thread share of each worker, as in ../DRAL-corpus/utils/workers.py.
+        n_threads = max(os.cpu_count() // n_workers, 1)
+        with ProcessPoolExecutor(
+            max_workers=n_workers,
+            initializer=_init_worker,
+            initargs=(specs, n_threads),
+        ) as executor:
+            job_results = list(executor.map(_run_job, *zip(*jobs)))
+    finally:
+        for shm in shms:
+            shm.close()
+            shm.unlink()
+
+    results = []
+    predictions = {}
+    n_rows = folds.shape[0]
+    for (model_name, task, _, idx_test, _), (result, Y_pred) in zip(jobs, job_results):
+        results.append(result)
+        key = f"{model_name}-{task.name}"
+        if key not in predictions:
+            predictions[key] = np.full((n_rows, Y_pred.shape[1]), np.nan, Y_pred.dtype)
+        predictions[key][idx_test] = Y_pred
+
+    return pd.DataFrame(results, columns=RESULTS_COLUMNS), predictions
+
+
+def _init_worker(specs: dict, n_threads: int) -> None:
+    # Limit torch and BLAS threads to this worker's share of the cores, as
+    # ../DRAL-corpus/utils/workers.py does (it is not importable from here).
+    torch.set_num_threads(n_threads)
+    threadpool_limits(n_threads)
+
+    # Attach to the feature arrays in shared memory.
+    for lang_code, (name, shape, dtype) in specs.items():
+        shm = shared_memory.SharedMemory(name=name)
+        _worker_shms.append(shm)
+        _worker_arrays[lang_code] = np.ndarray(shape, np.dtype(dtype), buffer=shm.buf)
+
+
+def _run_job(
+    model_name: str,
+    task: models_shared.Task,
+    idx_train: np.ndarray,
+    idx_test: np.ndarray,
+    fold: int,
+) -> tuple[dict, np.ndarray]:
+    # Standardize one fold, fit a model, and score its predictions. Returns the result
+    # and the predictions, in the original feature units.
+    if task is models_shared.Task.EN_TO_ES:
+        X, Y = _worker_arrays["EN"], _worker_arrays["ES"]
+    elif task is models_shared.Task.ES_TO_EN:
+        X, Y = _worker_arrays["ES"], _worker_arrays["EN"]
+    else:
+        raise ValueError(f"Invalid task: {task}")
+
+    X_train, X_test = models_shared.standardize_features(X[idx_train], X[idx_test])
+    # Keep the targets' scaler, to return the predictions in the original units.
+    scaler_Y = StandardScaler().fit(Y[idx_train])
+    Y_train, Y_test = scaler_Y.transform(Y[idx_train]), scaler_Y.transform(Y[idx_test])
+
+    fit, predict = MODELS[model_name]
+    time_start = time.perf_counter()
+    model = fit(X_train, Y_train, X_test, Y_test)
+    time_fit = time.perf_counter()
+    Y_pred = np.asarray(predict(model, X_test))
+    time_predict = time.perf_counter()
+
+    result = {
+        "model": model_name,
+        "task": task.name,
+        "fold": int(fold),
+        "score": float(metrics.mean_euclidean_distance(Y_test, Y_pred)),
+        "seconds_fit": time_fit - time_start,
+        "seconds_predict": time_predict - time_fit,
+        "n_train": idx_train.shape[0],
+        "n_test": idx_test.shape[0],
+    }
+    return result, scaler_Y.inverse_transform(Y_pred)
+
+
+if __name__ == "__main__":
+    main()